@@ -7,7 +7,14 @@ import warnings
 import numpy
 from sets import Set
 import logging
+import threading
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import iteratewcs
+import zonalstats
+import adaguccache
+import ncutils
 from netCDF4 import num2date 
 
 def defaultCallback(message,percentage):
@@ -20,230 +27,268 @@ def printfield(featuredata):
       mstr = "%s%0.2d" %(mstr, (featuredata[y][x]))
     print mstr
 
-def ADAGUCFeatureCombineNuts( featureNCFile,dataNCFile,bbox= "-40,20,60,85",variable = None, time= None,width=300,height=300,crs="EPSG:4326",outncfile="/tmp/stat.nc",outcsvfile="/tmp/stat.csv",callback=defaultCallback, tmpFolderPath = "/tmp", homeFolderPath="/tmp"):
+""" Memory budget for reducing a block of timesteps at once """
+DEFAULTMAXBLOCKBYTES = 256*1024*1024
+
+""" Estimated bytes needed per pixel and timestep: the input, float64 copies, masks and the five output rasters """
+BYTESPERPIXELSTEP = 96
+
+""" Maximum total size of the rasterised feature grids kept in the feature cache """
+FEATURECACHEMAXBYTES = 1024*1024*1024
+
+"""
+  Returns the number of timesteps which can be reduced at once for a feature raster of the given shape within maxBlockBytes.
+"""
+def getStepsPerBlock(shape,maxBlockBytes):
+  numPixels = max(1,int(numpy.prod(shape)))
+  return max(1,int(maxBlockBytes)//(numPixels*BYTESPERPIXELSTEP))
+
+"""
+  Returns the ISO 8601 string of a decoded date, dates in non-standard calendars have no isoformat and are formatted the same way.
+"""
+def isoformatDate(date):
+  try:
+    return date.isoformat()
+  except AttributeError:
+    return date.strftime("%Y-%m-%dT%H:%M:%S")
+
+""" State of an overlay worker process, set by initOverlayWorker """
+overlayWorkerState = {}
+
+"""
+  Starts an overlay worker process, the feature index is built and the data file is opened once per process.
+  With returnData the block which was read is sent back with its statistics, raster output needs it and then it is not read twice.
+"""
+def initOverlayWorker(featureNCFile,dataNCFile,returnData=False):
+  overlayWorkerState["featureindex"] = zonalstats.FeatureIndex.fromNetCDF(featureNCFile)
+  overlayWorkerState["dataset"] = netCDF4.Dataset(dataNCFile,'r')
+  overlayWorkerState["returnData"] = returnData
+
+"""
+  Reduces one (variable,blockStart,blockEnd) block in a worker process, the data is only sent back with the statistics when returnData is set.
+"""
+def overlayWorker(block):
+  currentVarName, blockStart, blockEnd = block
+  datainblock = overlayWorkerState["dataset"].variables[currentVarName][blockStart:blockEnd]
+  stats = zonalstats.zonalStatistics(overlayWorkerState["featureindex"],datainblock)
+  if overlayWorkerState["returnData"]:
+    return stats, datainblock
+  return stats, None
+
+def ADAGUCFeatureCombineNuts( featureNCFile,dataNCFile,bbox= "-40,20,60,85",variable = None, time= None,width=300,height=300,crs="EPSG:4326",outncfile="/tmp/stat.nc",outcsvfile="/tmp/stat.csv",callback=defaultCallback, tmpFolderPath = "/tmp", homeFolderPath="/tmp", cacheFolderPath=None, maxBlockBytes=DEFAULTMAXBLOCKBYTES, outtablefile=None, copyInputData=True, outputMode="raster", maxWorkers=1):
+
+  """ outputMode raster writes the statistics as rasters, region writes them as (time,region) variables next to the features raster """
+  if not outputMode in ["raster","region"]:
+    raise ValueError("Unknown outputMode "+str(outputMode)+", expected raster or region")
 
   os.chdir(homeFolderPath)
   
-  # 25 to 50
-  def featureCallBack(m,p):
-    callback("Retrieving features:[%s]" % m,25+(p/100.)*25);
-    return
-  # 50 to 75
-  def dataCallBack(m,p):
-    callback("Retrieving data:[%s]" % m,50+(p/100.)*25);
-    return
+  """ Features and data are retrieved concurrently, each with its own temporary directory and log file """
+  progress = {"features":0.,"data":0.}
+  progressLock = threading.Lock()
+  # 25 to 75, both retrievals contribute half of the range
+  def makeCallBack(name):
+    def retrievalCallBack(m,p):
+      with progressLock:
+        progress[name] = p
+        callback("Retrieving %s:[%s]" % (name,m),25+(progress["features"]/100.)*25+(progress["data"]/100.)*25);
+      return
+    return retrievalCallBack
 
-  status = iteratewcs.iteratewcs(
-    TIME=time,
-    BBOX=bbox,
-    CRS=crs,
-    WCSURL="source="+featureNCFile,
-    WIDTH=width,
-    HEIGHT=height,
-    COVERAGE='features',
-    TMP=tmpFolderPath,
-    OUTFILE=tmpFolderPath+"/features.nc",
-    FORMAT="netcdf",
-    LOGFILE=tmpFolderPath+"/adagucerrlogfeatures.txt",
-    CALLBACK=featureCallBack)
-
-  status = iteratewcs.iteratewcs(
-    TIME=time,
-    BBOX=bbox,
-    CRS=crs,
-    WCSURL="source="+dataNCFile,
-    WIDTH=width,
-    HEIGHT=height,
-    COVERAGE=variable,
-    TMP=tmpFolderPath,
-    OUTFILE=tmpFolderPath+"/data.nc",
-    FORMAT="netcdf",
-    LOGFILE=tmpFolderPath+"/adagucerrlogfeatures.txt",
-    CALLBACK=dataCallBack)
-        
-  callback("Starting feature overlay",75);        
-  statistic_names={"mean":"Average",
-                  "minimum":"Minumum",
-                  "maximum":"Maximum",
-                  "standarddeviation":"Standard deviation",
-                  "masked":"Masked"}
-
-  logging.debug("Reading from "+str(tmpFolderPath+"/features.nc"));
-  nc_features = netCDF4.Dataset( tmpFolderPath+"/features.nc",'r')
-  
-  nutsidvar = None
-  nutsascivar = None
+  """ Rasterised features only depend on the feature source and the grid, these are taken from the feature cache when the source can be validated """
+  featureCache = None
+  validatorCache = None
+  if cacheFolderPath != None:
+    featureCache = adaguccache.FileCache(cacheFolderPath+"/features",FEATURECACHEMAXBYTES)
+    """ Sources which can not be validated are remembered in the DescribeCoverage cache of iteratewcs """
+    validatorCache = adaguccache.DiskCache(cacheFolderPath,iteratewcs.DESCRIBECOVERAGECACHETTL,iteratewcs.DESCRIBECOVERAGECACHEMAXBYTES)
+  featureCacheKey = "source=%s;bbox=%s;width=%s;height=%s;crs=%s" % (featureNCFile,bbox,width,height,crs)
+
+  def retrieve(args):
+    name, source, coverage = args
+    outfile = tmpFolderPath+"/"+name+".nc"
+    validator = None
+    if name == "features" and featureCache != None:
+      validator = iteratewcs.getSourceValidator("source="+source,validatorCache)
+    if validator != None:
+      if featureCache.get(featureCacheKey,outfile,validator):
+        makeCallBack(name)("Features taken from cache",100)
+        return
+    status = iteratewcs.iteratewcs(
+      TIME=time,
+      BBOX=bbox,
+      CRS=crs,
+      WCSURL="source="+source,
+      WIDTH=width,
+      HEIGHT=height,
+      COVERAGE=coverage,
+      TMP=tmpFolderPath+"/"+name,
+      OUTFILE=outfile,
+      FORMAT="netcdf",
+      LOGFILE=tmpFolderPath+"/adagucerrlog"+name+".txt",
+      CACHEDIR=cacheFolderPath,
+      CALLBACK=makeCallBack(name))
+    if validator != None:
+      featureCache.put(featureCacheKey,outfile,validator)
+    return status
+
+  pool = ThreadPool(2)
   try:
-    nutsidvar = nc_features.variables["features_NUTS_ID"]
-  except:
-    pass
+    status = pool.map(retrieve,[("features",featureNCFile,"features"),("data",dataNCFile,variable)])
+  finally:
+    pool.close()
+    pool.join()
+        
+  """ Worker processes are started before any netCDF file is opened here, HDF5 does not survive a fork. Each worker builds the feature index and opens data.nc itself """
+  pool = None
+  if maxWorkers > 1:
+    pool = multiprocessing.Pool(maxWorkers,initOverlayWorker,(tmpFolderPath+"/features.nc",tmpFolderPath+"/data.nc",outputMode == "raster"))
   try:
-    nutsascivar = nc_features.variables["features_NAME_ASCI"]
-  except:
-    pass
-  featurevar = nc_features.variables["features"]
-
-  varstodo=[];
-  nc_data = netCDF4.Dataset( tmpFolderPath+"/data.nc",'r')
-  for v in nc_data.variables:
-    if len(nc_data.variables[v].dimensions)>2:
-      if v!="x" and v!="y" and v!="lon" and v!="lat":
-        varstodo.append(v)
-
-  logging.debug('writing to %s' % outncfile);
-  nc_out = netCDF4.Dataset( outncfile,'w',format="NETCDF4")
-
-  for var_name, dimension in nc_data.dimensions.iteritems():
-    nc_out.createDimension(var_name, len(dimension) if not dimension.isunlimited() else None)
-    
+    callback("Starting feature overlay",75);        
+    statistic_names={"mean":"Average",
+                    "minimum":"Minumum",
+                    "maximum":"Maximum",
+                    "standarddeviation":"Standard deviation",
+                    "masked":"Masked"}
 
-  for var_name, ncvar in nc_data.variables.iteritems():
-    outVar = nc_out.createVariable(var_name, ncvar.datatype, ncvar.dimensions)
-    ad = dict((k , ncvar.getncattr(k) ) for k in ncvar.ncattrs() )
-    outVar.setncatts(  ad  )
-    try:
-      outVar[:] = ncvar[:]
-    except:
-      try: 
-        outVar = ncvar
-      except:
-        logging.debug("Data for variable "+str(var_name)+" could not be written")
-        pass
-      pass
-    """ When a 2D+ var hasbeen found, copy its name and create vars for all statistics we want to calculate """
-    if var_name in varstodo:
-      for name in statistic_names:
-        new_var_name = var_name+"_"+name
-        outVar = nc_out.createVariable(new_var_name, "f4", ncvar.dimensions,fill_value=-9999.0 )
-        ad={}
-        for k in ["units","standard_name","long_name"]:
-          try:
-            ad[k]=ncvar.getncattr(k)
-          except:
-            ad[k]="none"
-            pass
-        if "long_name" in ad:
-          ad["long_name"]=statistic_names[name]+' of '+ad["long_name"]
-        outVar.setncatts(  ad  )
-
-
-
-  """ Copy NutsID names to output file """
-  for var_name, dimension in nc_features.dimensions.iteritems():
-    if not var_name in nc_out.dimensions:
-      nc_out.createDimension(var_name, len(dimension) if not dimension.isunlimited() else None)
-  outVar = nc_out.createVariable("features", "i4", featurevar.dimensions)
-  outVar[:] = featurevar[:]
+    logging.debug("Reading from "+str(tmpFolderPath+"/features.nc"));
+    nc_features = netCDF4.Dataset( tmpFolderPath+"/features.nc",'r')
   
-  nutsiddata = None
-  nutsascidata = None
-  if nutsidvar is not None:
-    nutsiddata = nutsidvar[:]
-  if nutsascivar is not None:
-    nutsascidata = nutsascivar[:]
-  featureindexdata=featurevar[:]
-  featureindexdata.mask=False
-
-  featureCount = {}
-  featureSum = {}
+    featurevar = nc_features.variables["features"]
+
+    varstodo=[];
+    nc_data = netCDF4.Dataset( tmpFolderPath+"/data.nc",'r')
+    for v in nc_data.variables:
+      if len(nc_data.variables[v].dimensions)>2:
+        if v!="x" and v!="y" and v!="lon" and v!="lat":
+          varstodo.append(v)
+
+    logging.debug('writing to %s' % outncfile);
+    nc_out = netCDF4.Dataset( outncfile,'w',format="NETCDF4")
+
+    ncutils.copyDimensions(nc_data,nc_out)
+
+    statistic_attributes = {}
+    for var_name, ncvar in nc_data.variables.iteritems():
+      """ Input variables are copied slab by slab, the data of the processed variables only when copyInputData is set """
+      if copyInputData == True or not var_name in varstodo:
+        outVar = ncutils.copyVariable(ncvar,nc_out,copydata=False)
+        try:
+          ncutils.copyVariableData(ncvar,outVar)
+        except Exception as e:
+          logging.debug("Data for variable "+str(var_name)+" could not be written: "+str(e))
+      """ When a 2D+ var hasbeen found, copy its name and create vars for all statistics we want to calculate """
+      if var_name in varstodo:
+        for name in statistic_names:
+          new_var_name = var_name+"_"+name
+          ad={}
+          for k in ["units","standard_name","long_name"]:
+            try:
+              ad[k]=ncvar.getncattr(k)
+            except:
+              ad[k]="none"
+              pass
+          if "long_name" in ad:
+            ad["long_name"]=statistic_names[name]+' of '+ad["long_name"]
+          statistic_attributes[new_var_name] = ad
+          if outputMode == "raster":
+            outVar = nc_out.createVariable(new_var_name, "f4", ncvar.dimensions,fill_value=-9999.0 )
+            outVar.setncatts(  ad  )
+
+
+
+    """ Copy NutsID names to output file """
+    ncutils.copyDimensions(nc_features,nc_out)
+    outVar = nc_out.createVariable("features", "i4", featurevar.dimensions)
+    outVar[:] = featurevar[:]
   
-  CSV="time;variable;index;id;name;numsamples;min;mean;max;std;\n"
-
-  numVariables = len(varstodo)
-  numVariablesDone = -1;
-  """ Iterate over all variables """
-  for currentVarName in varstodo:
-    numVariablesDone = numVariablesDone + 1
-    nodatavalue= featurevar._FillValue
-    invar_datain = nc_data.variables[currentVarName]
-    outvar_min   = nc_out.variables[currentVarName+"_minimum"];
-    outvar_mean  = nc_out.variables[currentVarName+"_mean"];
-    outvar_max   = nc_out.variables[currentVarName+"_maximum"];
-    outvar_std   = nc_out.variables[currentVarName+"_standarddeviation"];
-    outvar_mask  = nc_out.variables[currentVarName+"_masked"];
-    
-    """ Iterate over all timesteps """
-    timeValue = "None"
+    """ The feature raster is the same for all timesteps and variables, its index is built once """
+    featureindex = zonalstats.FeatureIndex.fromDataset(nc_features)
+  
+    """ Rows are written to the CSV file as they are produced """
+    csvwriter = zonalstats.StatisticsCSVWriter(outcsvfile)
+  
+    """ The statistics are written as (time,region) tables into the output file in region mode, optionally also into outtablefile """
+    tablewriters = []
+    if outputMode == "region":
+      tablewriters.append(zonalstats.StatisticsTableWriter(nc_out,featureindex,nc_data.variables["time"]))
+    nc_table = None
+    if outtablefile is not None:
+      nc_table = netCDF4.Dataset( outtablefile,'w',format="NETCDF4")
+      tablewriters.append(zonalstats.StatisticsTableWriter(nc_table,featureindex,nc_data.variables["time"]))
+    for tablewriter in tablewriters:
+      for var_name in varstodo:
+        for name in statistic_names:
+          if name != "masked":
+            tablewriter.addVariable(var_name+"_"+name,statistic_attributes[var_name+"_"+name])
+
     timeVar = nc_data.variables["time"]
     calendarAttr = "standard"
     try:
         calendarAttr=timeVar.calendar
     except:
         pass
-    
+  
     numTimeSteps = numpy.shape(timeVar)[0]
-    for currentStep in range(0,numTimeSteps):
-      """ Read time value """
-      timeValueDouble = timeVar[currentStep]
-      timeValue = num2date(timeValueDouble, units=timeVar.units,calendar=calendarAttr).isoformat()#strftime("%Y %M %D %h %m %S")
-      """ Read data from netCDF Variables """
-      datainflat = invar_datain[currentStep]
-      dataout_minflat = outvar_min[currentStep]
-      dataout_meanflat = outvar_mean[currentStep]
-      dataout_maxflat = outvar_max[currentStep]
-      dataout_stdflat = outvar_std[currentStep]
-      dataout_maskflat = outvar_mask[currentStep]
-      totalmean = numpy.nanmean(datainflat)
-      foundregionindexes=numpy.unique(featureindexdata)
-      numRegionsDone = -1
-      numRegionIndexes = len(foundregionindexes)
-      for regionindex in foundregionindexes:
-        numRegionsDone += 1
-        if numRegionsDone % 10 == 0:
-          fracVarsDone = numVariablesDone / float(numVariables)
-          fracStepDone = currentStep / float(numTimeSteps)
-          fracRegionDone = numRegionsDone / float(numRegionIndexes)
-          fracRegionTimeDone = fracStepDone + (fracRegionDone/float(numTimeSteps))
-          fracRegionTimeVarsDone = fracVarsDone + (fracRegionTimeDone/float(numVariables))
-          callback("For var %s and time (%d/%d) working on feature index nr %d (%d/%d)" %(currentVarName,currentStep,numTimeSteps,regionindex,numRegionsDone,numRegionIndexes),(fracRegionTimeVarsDone)*24.+75.);  
-        
-        if not regionindex is numpy.ma.masked and nodatavalue != regionindex:
-          indices = numpy.where(featureindexdata==regionindex)
-          selecteddata=datainflat[indices]
-          
-          allmask = False
-          try:
-            if selecteddata.mask.all() == True:
-              allmask = True
-          except:
-            pass
-            
-          if allmask == False:
-            try: 
-              minval =  numpy.nanmin(selecteddata)
-              meanval=  numpy.nanmean(selecteddata)
-              maxval =  numpy.nanmax(selecteddata)
-              stdval =  numpy.nanstd(selecteddata)
-              dataout_minflat[indices]=minval
-              dataout_meanflat[indices]=meanval
-              dataout_maxflat[indices]=maxval
-              dataout_stdflat[indices]=stdval
-              dataout_maskflat[indices]=selecteddata
-              regid = regionindex
-              reglongname=regid
-              if nutsiddata is not None:
-                regid = nutsiddata[regionindex]
-              if nutsascidata is not None:
-                reglongname = nutsascidata[regionindex]
-              CSV += timeValue+";"+str(currentVarName)+";"+str(regionindex)+";"+str(regid)+";"+str(reglongname)+";"+str(len(selecteddata))+";"+str(minval)+";"+str(meanval)+";"+str(maxval)+";"+str(stdval)+"\n"
-            except ValueError: 
-              logging.debug('Masks all around!')
-              pass 
-          
-      """ Assign each timestep to NetCDF variables """
-      outvar_min[currentStep]=dataout_minflat;
-      outvar_mean[currentStep]=dataout_meanflat;
-      outvar_max[currentStep]=dataout_maxflat;
-      outvar_std[currentStep]=dataout_stdflat;
-      outvar_mask[currentStep]=dataout_maskflat;
+
+    """ The time axis is decoded once as a vector, the ISO strings are reused for all variables """
+    timeStrings = []
+    if numTimeSteps > 0:
+      timeStrings = [isoformatDate(date) for date in numpy.ravel(num2date(timeVar[:], units=timeVar.units,calendar=calendarAttr))]
   
-  callback("Writing data",99);  
-  nc_out.close()  
+    """ Timesteps are read, reduced and written in blocks which fit within maxBlockBytes, with maxWorkers at most maxWorkers+1 blocks are underway """
+    blocksUnderway = 1
+    if pool is not None:
+      blocksUnderway = maxWorkers+1
+    stepsPerBlock = getStepsPerBlock(featureindex.shape,maxBlockBytes/blocksUnderway)
+    blocks = []
+    for currentVarName in varstodo:
+      for blockStart in range(0,numTimeSteps,stepsPerBlock):
+        blocks.append((currentVarName,blockStart,min(blockStart+stepsPerBlock,numTimeSteps)))
+
+    def reduceBlock(block):
+      currentVarName, blockStart, blockEnd = block
+      """ Read data from netCDF Variables """
+      datainblock = nc_data.variables[currentVarName][blockStart:blockEnd]
+      return zonalstats.zonalStatistics(featureindex,datainblock), datainblock
+
+    """ With maxWorkers the blocks are reduced by worker processes, the results are written here in order as they are submitted """
+    if pool is not None:
+      results = iteratewcs.orderedMap(pool,overlayWorker,blocks,blocksUnderway)
+    else:
+      results = itertools.imap(reduceBlock,blocks)
 
-  out = open( outcsvfile , 'wb')
-  out.write( CSV )
-  out.close()
-  return
+    for j, ((currentVarName,blockStart,blockEnd), (stats,datainblock)) in enumerate(itertools.izip(blocks,results)):
+      callback("For var %s and time (%d-%d/%d) working on %d feature indices" %(currentVarName,blockStart,blockEnd,numTimeSteps,len(featureindex)),(j/float(len(blocks)))*24.+75.);  
+    
+      """ Regions without any unmasked pixel are skipped """
+      keep = stats["unmasked"] > 0
+    
+      """ Assign the block to NetCDF variables """
+      if outputMode == "raster":
+        for name in statistic_names:
+          outvar = nc_out.variables[currentVarName+"_"+name]
+          if name == "masked":
+            outvar[blockStart:blockEnd]=zonalstats.maskToRegions(featureindex,datainblock,keep);
+          else:
+            outvar[blockStart:blockEnd]=zonalstats.expandToRaster(featureindex,stats[name],datainblock.shape,keep);
+    
+      csvwriter.writeBlock(featureindex,currentVarName,timeStrings[blockStart:blockEnd],stats,keep)
+      for tablewriter in tablewriters:
+        for name in statistic_names:
+          if name != "masked":
+            tablewriter.writeBlock(currentVarName+"_"+name,blockStart,stats[name],keep)
+  
+    callback("Writing data",99);  
+    nc_out.close()  
+    csvwriter.close()
+    if nc_table is not None:
+      nc_table.close()
+    return
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
 
 def test():
 
@@ -5,7 +5,17 @@ import netCDF4
 from netCDF4 import MFDataset
 import sys
 from subprocess import PIPE, Popen, STDOUT
-from threading  import Thread
+import select
+import io
+import errno
+import socket
+import struct
+import tempfile
+import atexit
+import logging
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
 import json
 import os
 import shutil
@@ -13,123 +23,542 @@ from mkdir_p import *
 import zipfile
 from xml.sax.saxutils import escape
 
+""" Zero-copy view on data from offset, python 2 file objects only accept buffer objects in text mode """
+try:
+  bodyView = buffer
+except NameError:
+  def bodyView(data,offset):
+    return memoryview(data)[offset:]
+
+""" Maximum number of processes run at the same time by CGIRunner, set before the first call or raise it with setMinimumConcurrentProcesses """
+MAXCONCURRENTPROCESSES = 4
+
+processLock = threading.Lock()
+processSlots = None
+processPool = None
+processLimit = 0
+baseEnvironment = None
+
+def _createProcessPool():
+  global processSlots, processPool, processLimit
+  if processPool == None:
+    processLimit = MAXCONCURRENTPROCESSES
+    processSlots = threading.Semaphore(processLimit)
+    processPool = ThreadPool(processLimit)
+
+"""
+  Returns the semaphore which limits the number of running processes and the pool which runs arun and astartProcess calls.
+  All callers in this python process share them, the pool and the semaphore are created on first use.
+"""
+def getProcessPool():
+  with processLock:
+    _createProcessPool()
+    return processSlots, processPool
+
+"""
+  Raises the number of processes which may run at the same time to at least n, e.g. for a caller which wants n concurrent requests.
+  The limit is never lowered. Calls already submitted finish in the previous pool, its idle threads are kept.
+"""
+def setMinimumConcurrentProcesses(n):
+  global processPool, processLimit
+  with processLock:
+    _createProcessPool()
+    if n <= processLimit:
+      return
+    for j in range(n - processLimit):
+      processSlots.release()
+    processPool = ThreadPool(n)
+    processLimit = n
+
+"""
+  Returns a copy of os.environ which is made once and shared by all calls, the per call variables are put on top of it with EnvironmentOverlay.
+  Call resetBaseEnvironment after changing os.environ.
+"""
+def getBaseEnvironment():
+  global baseEnvironment
+  with processLock:
+    if baseEnvironment == None:
+      baseEnvironment = dict(os.environ)
+  return baseEnvironment
+
+def resetBaseEnvironment():
+  global baseEnvironment
+  with processLock:
+    baseEnvironment = None
+
+"""
+  Read only mapping of the variables in overlay on top of those in base, neither is copied. Popen accepts it as env.
+"""
+class EnvironmentOverlay(collections.Mapping):
+
+  def __init__(self,base,overlay):
+    self.base = base
+    self.overlay = overlay
+
+  def __getitem__(self,name):
+    if name in self.overlay:
+      return self.overlay[name]
+    return self.base[name]
+
+  def __contains__(self,name):
+    return name in self.overlay or name in self.base
+
+  def __iter__(self):
+    for name in self.overlay:
+      yield name
+    for name in self.base:
+      if not name in self.overlay:
+        yield name
+
+  def __len__(self):
+    return len(self.base) + len([name for name in self.overlay if not name in self.base])
+
+""" Size of the reused buffer in which the body of a CGI response is read """
+STREAMBLOCKSIZE = 1024*1024
+
+"""
+  Writes all of data to the unbuffered file f, FileIO.write may write less than asked.
+"""
+def writeAll(f,data):
+  view = memoryview(data) if isinstance(data,bytearray) else data
+  while len(view) > 0:
+    written = f.write(view)
+    view = view[written:]
+
 class CGIRunner:
   
   def __init__(self):
-    self.headersSent = False
-    self.foundLF = False
+    self.resetHeader()
     
+  """
+    Forgets the headers of a previous response, call before filtering a new response
+  """
+  def resetHeader(self):
+    self.headersSent = False
+    self.headerData = b""
+    self.headers = {}
+    self.contentLength = None
+    self.contentType = None
  
-  def startProcess(self,cmds,callback=None,env = None,bufsize=0):
-    try:
-        from Queue import Queue, Empty
-    except ImportError:
-        from queue import Queue, Empty  # python 3.x
-
+  """
+    Runs cmds and passes their output (stdout and stderr) to callback as soon as it arrives, without threads, queues or sleeps.
+    The callback gets chunks of at most bufsize bytes (64 KB when 0), or complete lines when lines is True.
+    Returns when the process has exited and its output is read, or when it has exited and only its children keep the output open.
+  """
+  def startProcess(self,cmds,callback=None,env = None,bufsize=0,lines=False):
     ON_POSIX = 'posix' in sys.builtin_module_names
+    chunksize = bufsize if bufsize > 0 else 65536
 
-    def enqueue_output(out, queue):
-        for line in iter(out.readline, b''):
-            queue.put(line)
-        out.close()
-
-
-    p = Popen(cmds, stdout=PIPE, stderr=STDOUT,bufsize=bufsize, close_fds=ON_POSIX,env=env)
-    q = Queue()
-    t = Thread(target=enqueue_output, args=(p.stdout, q))
-    t.daemon = True # thread dies with the program
-    t.start()
-
-    #http://stackoverflow.com/questions/156360/get-all-items-from-thread-queue
-    # read line without blocking
-    while True:
-      #time.sleep(100/1000000.0)
-      #time.sleep(0.01)
-      try:  
-        line = q.get(timeout=.01)
-        if(callback != None):
-          callback(line)
-      except Empty:
-          if(t.isAlive() == False):
-            break;
-    
-    """ Sometimes stuff is still in que """
-    
-    while True:
-      #time.sleep(100/1000000.0)
-      time.sleep(0.1)
-      try:  
-        line = q.get(timeout=.1)
-        if(callback != None):
-          callback(line)
-      except Empty:
-          if(t.isAlive() == False):
-            break;
+    p = Popen(cmds, stdout=PIPE, stderr=STDOUT,bufsize=0, close_fds=ON_POSIX,env=env)
+    fd = p.stdout.fileno()
+    pending = b""
+    try:
+      while True:
+        """ Wait for output, wake up once a second to notice a process which exited while its children keep the pipe open """
+        readable = select.select([fd],[],[],1.0)[0]
+        if len(readable) == 0:
+          if p.poll() != None:
+            break
+          continue
+        data = os.read(fd,chunksize)
+        if len(data) == 0:
+          break
+        if callback == None:
+          continue
+        if lines == True:
+          parts = (pending + data).split(b"\n")
+          pending = parts.pop()
+          for part in parts:
+            callback(part + b"\n")
+        else:
+          callback(data)
+      if len(pending) > 0 and callback != None:
+        callback(pending)
+    finally:
+      p.stdout.close()
   
     return p.wait()
   
+  """
+    Returns the header value for name, header names are case insensitive.
+  """
+  def getHeader(self,name,default=None):
+    for key in self.headers:
+      if key.lower() == name.lower():
+        return self.headers[key]
+    return default
+
+  def parseHeaders(self,headerData):
+    self.headers = {}
+    for line in headerData.split(b"\n"):
+      line = line.rstrip(b"\r")
+      if b":" in line:
+        key, value = line.split(b":",1)
+        self.headers[key.strip()] = value.strip()
+    self.contentType = self.getHeader("Content-Type")
+    self.contentLength = None
+    try:
+      self.contentLength = int(self.getHeader("Content-Length"))
+    except (TypeError,ValueError):
+      pass
+
+  """
+    Strips the CGI headers from a response which is passed in chunks, the body is passed to writefunction.
+    The headers end with an empty line, which may be split over two chunks.
+    The headers are available as a dict in self.headers, and as self.contentLength and self.contentType.
+    The body of the chunk in which the headers end is passed as a view, without copying it.
+  """
   def filterHeader(self,_message,writefunction):
-      if self.headersSent == False:
-        message = bytearray(_message)
-        endHeaderIndex = 0
-        for j in range(len(message)):
-          if message[j] == 10 :
-            if self.foundLF == False:
-              self.foundLF = True
-              #print "LF Found"
-              continue
-          elif self.foundLF == True and message[j] != 13:
-            self.foundLF = False
-            #print "Sorry, not LF Found"
-            continue
-          
-          if(self.foundLF == True):  
-            if message[j] == 10 :
-              #print "Second LF Found"
-              self.headersSent = True;
-              endHeaderIndex = j+2;
-              #print "HEADER FOUND"
-              #print message[:endHeaderIndex]
-              writefunction(message[endHeaderIndex:])
-              
-              break;
-      else:
+      if self.headersSent == True:
         writefunction(_message)
+        return
+      """ Continue a few bytes back in the previous data, the empty line may have started there """
+      start = max(0,len(self.headerData)-2)
+      if len(self.headerData) == 0:
+        data = bytes(_message)
+      else:
+        data = self.headerData + bytes(_message)
+      end = -1
+      for separator in [b"\n\n",b"\n\r\n"]:
+        index = data.find(separator,start)
+        if index != -1 and (end == -1 or index+len(separator) < end):
+          end = index+len(separator)
+      if end == -1:
+        self.headerData = data
+        return
+      self.parseHeaders(data[:end])
+      self.headersSent = True
+      self.headerData = b""
+      if end < len(data):
+        writefunction(bodyView(data,end))
  
  
   """
     Behaves like a dynamic webserver. Run executables in webserver environment and can strip the headers from the response
     isLocalADAGUC sets ADAGUC_WRITETOFILE where the results will be written, normaly ADAGUC writes to stdout. 
+    At most MAXCONCURRENTPROCESSES processes run at the same time, further calls wait for a free slot.
   """  
   def run(self,cmds,url,out,extraenv = [], isLocalADAGUC = False):
+    slots = getProcessPool()[0]
+    with slots:
+      return self._run(cmds,url,out,extraenv,isLocalADAGUC)
+
+  def _run(self,cmds,url,out,extraenv,isLocalADAGUC):
     try:
       os.remove(out)
     except:
       pass
     
+    percall = {'QUERY_STRING':url}
+    if(isLocalADAGUC == True):
+      percall['ADAGUC_WRITETOFILE']=out
+    percall.update(extraenv)
+    env = EnvironmentOverlay(getBaseEnvironment(),percall)
     if(isLocalADAGUC == True):
-      env = os.environ.copy()
-      env['QUERY_STRING']=url
-      env['ADAGUC_WRITETOFILE']=out
-      env.update(extraenv)  
       from subprocess import call
       status = call(cmds, stdin=None, stdout=None, stderr=None, shell=False, env=env)
     else:
-      ncout = open(out,"a+b")
-    
-      self.headersSent = False
-      self.foundLF = False
-      
-      def writefunction(data):
-        ncout.write(data)
-      
-      def monitor1(_message):
-        self.filterHeader(_message,writefunction)
-      
-      env = os.environ.copy()
-      env['QUERY_STRING']=url
-      env.update(extraenv)  
-      status = self.startProcess(cmds,monitor1,env,bufsize=8192)
-      ncout.close()
+      self.resetHeader()
+      status = self.streamProcess(cmds,out,env)
       
     return status
+
+  """
+    Runs cmds and writes the body of its CGI response to the file out, the headers are stripped and kept in self.headers.
+    Until the headers are complete the output passes filterHeader, after that blocks are read with readinto in one reused buffer
+    and written to out without copies, or moved from the pipe to out by the kernel with os.splice where python has it.
+  """
+  def streamProcess(self,cmds,out,env=None,blocksize=STREAMBLOCKSIZE):
+    ON_POSIX = 'posix' in sys.builtin_module_names
+    p = Popen(cmds, stdout=PIPE, stderr=STDOUT,bufsize=0, close_fds=ON_POSIX,env=env)
+    pipe = io.FileIO(p.stdout.fileno(),"r",closefd=False)
+    ncout = io.open(out,"wb",buffering=0)
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    splice = getattr(os,"splice",None)
+    try:
+      while True:
+        """ Wait for output, wake up once a second to notice a process which exited while its children keep the pipe open """
+        readable = select.select([pipe],[],[],1.0)[0]
+        if len(readable) == 0:
+          if p.poll() != None:
+            break
+          continue
+        if self.headersSent == True and splice != None:
+          try:
+            if splice(pipe.fileno(),ncout.fileno(),blocksize) == 0:
+              break
+            continue
+          except OSError as e:
+            if e.errno != errno.EINVAL:
+              raise
+            splice = None
+        size = pipe.readinto(buf)
+        if not size:
+          break
+        if self.headersSent == True:
+          writeAll(ncout,view[:size])
+        else:
+          self.filterHeader(buf[:size],lambda data: writeAll(ncout,data))
+    finally:
+      ncout.close()
+      pipe.close()
+      p.stdout.close()
+
+    return p.wait()
+
+  """
+    Starts run in the shared process pool and returns at once with an AsyncResult, its get() returns the exit status or raises the error of run.
+    Each call uses its own CGIRunner, the header state of a response is kept in the runner.
+  """
+  def arun(self,cmds,url,out,extraenv = [], isLocalADAGUC = False, callback = None):
+    return getProcessPool()[1].apply_async(CGIRunner().run,(cmds,url,out,extraenv,isLocalADAGUC),callback=callback)
+
+  """
+    Starts startProcess in the shared process pool and returns at once with an AsyncResult, the output callback is called from a pool thread.
+  """
+  def astartProcess(self,cmds,callback=None,env = None,bufsize=0,lines=False):
+    def start():
+      with getProcessPool()[0]:
+        return CGIRunner().startProcess(cmds,callback,env,bufsize,lines)
+    return getProcessPool()[1].apply_async(start)
+
+
+""" FastCGI record types and the responder role, see the FastCGI specification """
+FCGI_VERSION = 1
+FCGI_BEGIN_REQUEST = 1
+FCGI_END_REQUEST = 3
+FCGI_PARAMS = 4
+FCGI_STDIN = 5
+FCGI_STDOUT = 6
+FCGI_STDERR = 7
+FCGI_RESPONDER = 1
+FCGI_HEADER = struct.Struct(">BBHHBx")
+FCGI_MAXCONTENT = 65535
+
+""" Seconds a FastCGI worker may stay silent during a request before it is considered hung and replaced """
+WORKERTIMEOUT = 600
+
+""" Seconds a stopped worker gets to exit before it is killed """
+WORKERSTOPTIMEOUT = 5
+
+def encodeFCGIRecord(recordtype,content,requestid=1):
+  records = []
+  for start in range(0,max(1,len(content)),FCGI_MAXCONTENT):
+    part = content[start:start+FCGI_MAXCONTENT]
+    records.append(FCGI_HEADER.pack(FCGI_VERSION,recordtype,requestid,len(part),0)+part)
+  return b"".join(records)
+
+def encodeFCGIParams(params):
+  data = []
+  for name, value in params.items():
+    name = str(name)
+    value = str(value)
+    for length in [len(name),len(value)]:
+      data.append(struct.pack(">B",length) if length < 128 else struct.pack(">I",length | 0x80000000))
+    data.append(name)
+    data.append(value)
+  return b"".join(data)
+
+def receiveExactly(sock,size):
+  data = []
+  while size > 0:
+    part = sock.recv(size)
+    if len(part) == 0:
+      raise ValueError("FastCGI worker closed the connection")
+    data.append(part)
+    size = size - len(part)
+  return b"".join(data)
+
+"""
+  A long-lived FastCGI application, like adagucserver built with FastCGI support.
+  The application is started with a listening unix socket as stdin, as spawn-fcgi does, and each request uses a new connection.
+"""
+class FastCGIWorker:
+
+  def __init__(self,cmds,env=None,timeout=None):
+    self.socketdir = tempfile.mkdtemp(prefix="cgirunner")
+    self.socketpath = self.socketdir+"/worker.sock"
+    self.timeout = timeout
+    self.requests = 0
+    listener = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+      listener.bind(self.socketpath)
+      listener.listen(16)
+      devnull = open(os.devnull,"w")
+      try:
+        self.process = Popen(cmds,stdin=listener.fileno(),stdout=devnull,stderr=devnull,close_fds=True,env=env)
+      finally:
+        devnull.close()
+    finally:
+      listener.close()
+    logging.debug("Started FastCGI worker %d for %s" % (self.process.pid," ".join(cmds)))
+
+  """
+    Health check: the process is running and its socket exists.
+  """
+  def isAlive(self):
+    return self.process.poll() == None and os.path.exists(self.socketpath)
+
+  """
+    Sends one request with params as CGI environment, the response (CGI headers and body) is passed to callback in chunks.
+    Returns the application status of the response.
+  """
+  def request(self,params,callback=None):
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+      sock.settimeout(self.timeout)
+      sock.connect(self.socketpath)
+      sock.sendall(encodeFCGIRecord(FCGI_BEGIN_REQUEST,struct.pack(">HB5x",FCGI_RESPONDER,0)) +
+                   encodeFCGIRecord(FCGI_PARAMS,encodeFCGIParams(params)) + encodeFCGIRecord(FCGI_PARAMS,b"") +
+                   encodeFCGIRecord(FCGI_STDIN,b""))
+      self.requests = self.requests + 1
+      while True:
+        version, recordtype, requestid, contentlength, paddinglength = FCGI_HEADER.unpack(receiveExactly(sock,FCGI_HEADER.size))
+        content = receiveExactly(sock,contentlength+paddinglength)[:contentlength]
+        if recordtype == FCGI_STDOUT:
+          if len(content) > 0 and callback != None:
+            callback(content)
+        elif recordtype == FCGI_STDERR:
+          logging.debug(content)
+        elif recordtype == FCGI_END_REQUEST:
+          return struct.unpack(">IB3x",content)[0]
+    finally:
+      sock.close()
+
+  def close(self):
+    if self.process.poll() == None:
+      self.process.terminate()
+      stoptime = time.time() + WORKERSTOPTIMEOUT
+      while self.process.poll() == None and time.time() < stoptime:
+        time.sleep(0.05)
+      if self.process.poll() == None:
+        self.process.kill()
+    self.process.wait()
+    shutil.rmtree(self.socketdir,True)
+    logging.debug("Stopped FastCGI worker %d after %d requests" % (self.process.pid,self.requests))
+
+"""
+  Keeps up to size warm FastCGI workers for cmds and hands out one per request, instead of starting the executable for every call.
+  Workers are checked before use, a worker which failed or handled maxrequests requests is stopped and replaced by a new one.
+"""
+class WorkerPool:
+
+  def __init__(self,cmds,size=2,maxrequests=100,env=None,timeout=WORKERTIMEOUT):
+    self.cmds = cmds
+    self.size = size
+    self.maxrequests = maxrequests
+    self.env = env
+    self.timeout = timeout
+    self.idle = []
+    self.numworkers = 0
+    self.condition = threading.Condition()
+
+  def acquire(self):
+    with self.condition:
+      while True:
+        while len(self.idle) > 0:
+          worker = self.idle.pop()
+          if worker.isAlive():
+            return worker
+          logging.debug("FastCGI worker %d is not running anymore, replacing it" % worker.process.pid)
+          self.discard(worker)
+        if self.numworkers < self.size:
+          self.numworkers = self.numworkers + 1
+          break
+        self.condition.wait()
+    try:
+      return FastCGIWorker(self.cmds,EnvironmentOverlay(getBaseEnvironment(),self.env or {}),self.timeout)
+    except:
+      with self.condition:
+        self.numworkers = self.numworkers - 1
+        self.condition.notify()
+      raise
+
+  """ Stops worker and frees its place in the pool, the caller holds the condition """
+  def discard(self,worker):
+    self.numworkers = self.numworkers - 1
+    self.condition.notify()
+    worker.close()
+
+  def release(self,worker,failed=False):
+    with self.condition:
+      if failed or worker.requests >= self.maxrequests or not worker.isAlive():
+        self.discard(worker)
+      else:
+        self.idle.append(worker)
+        self.condition.notify()
+
+  """
+    Like CGIRunner.run, but the request is handled by a warm worker. A request which fails on a worker is tried once more on a new worker.
+    The worker is always given back to the pool, also when the request raises.
+  """
+  def run(self,url,out,extraenv = [], isLocalADAGUC = False):
+    """ A FastCGI application gets the params as its whole environment, so they start from the environment of a CGI call """
+    percall = dict(self.env or {})
+    percall.update({"GATEWAY_INTERFACE":"CGI/1.1","REQUEST_METHOD":"GET","SERVER_PROTOCOL":"HTTP/1.1","QUERY_STRING":url})
+    if(isLocalADAGUC == True):
+      percall['ADAGUC_WRITETOFILE']=out
+    percall.update(extraenv)
+    params = EnvironmentOverlay(getBaseEnvironment(),percall)
+    for attempt in range(2):
+      try:
+        os.remove(out)
+      except:
+        pass
+      worker = self.acquire()
+      try:
+        if(isLocalADAGUC == True):
+          status = worker.request(params)
+        else:
+          runner = CGIRunner()
+          ncout = open(out,"wb")
+          try:
+            status = worker.request(params,lambda data: runner.filterHeader(data,ncout.write))
+          finally:
+            ncout.close()
+      except (socket.error,ValueError,struct.error) as e:
+        """ Connection and protocol errors are tried once more on a new worker """
+        self.release(worker,True)
+        if attempt > 0:
+          raise ValueError("FastCGI worker for %s failed: %s" % (" ".join(self.cmds),str(e)))
+        logging.debug("FastCGI worker failed, retrying on a new worker: %s" % str(e))
+        continue
+      except BaseException:
+        """ Other errors, e.g. writing out, are raised at once, the worker may be halfway a response and is replaced """
+        self.release(worker,True)
+        raise
+      self.release(worker)
+      return status
+
+  """
+    Starts run in the shared process pool of CGIRunner and returns an AsyncResult.
+  """
+  def arun(self,url,out,extraenv = [], isLocalADAGUC = False, callback = None):
+    return getProcessPool()[1].apply_async(self.run,(url,out,extraenv,isLocalADAGUC),callback=callback)
+
+  def close(self):
+    with self.condition:
+      while len(self.idle) > 0:
+        self.discard(self.idle.pop())
+
+workerPools = {}
+
+"""
+  Returns the WorkerPool for cmds, pools are shared by all callers in this python process and stopped at exit.
+  A worker which is silent for timeout seconds during a request is replaced.
+"""
+def getWorkerPool(cmds,size=2,maxrequests=100,timeout=WORKERTIMEOUT):
+  with processLock:
+    key = tuple(cmds)
+    if not key in workerPools:
+      workerPools[key] = WorkerPool(list(cmds),size,maxrequests,timeout=timeout)
+    return workerPools[key]
+
+def closeWorkerPools():
+  with processLock:
+    for pool in workerPools.values():
+      pool.close()
+    workerPools.clear()
+
+atexit.register(closeWorkerPools)
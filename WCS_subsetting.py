@@ -97,7 +97,7 @@ class Process(WPSProcess):
         FORMAT = self.outputFormat.getValue();
         status = -1
         try:
-          status = iteratewcs.iteratewcs(TIME=TIME,BBOX=BBOX,CRS=CRS,WCSURL=WCSURL,RESX=RESX,RESY=RESY,COVERAGE=self.coverage.getValue(),TMP=tmpFolderPath,OUTFILE=fileOutPath+"/"+outputfile,FORMAT=FORMAT,LOGFILE=tmpFolderPath+"/adagucerrlog.txt",CALLBACK=callback)
+          status = iteratewcs.iteratewcs(TIME=TIME,BBOX=BBOX,CRS=CRS,WCSURL=WCSURL,RESX=RESX,RESY=RESY,COVERAGE=self.coverage.getValue(),TMP=tmpFolderPath,OUTFILE=fileOutPath+"/"+outputfile,FORMAT=FORMAT,LOGFILE=tmpFolderPath+"/adagucerrlog.txt",CACHEDIR=home+"/.cache/iteratewcs",CALLBACK=callback)
         except Exception as e:
           return "Iterate over WCS Failed:\n "+str(e).replace('&','&amp;')
           
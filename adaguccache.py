@@ -0,0 +1,171 @@
+"""
+Persistent on-disk cache for results of ADAGUC requests.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from mkdir_p import *
+
+"""
+  Stores JSON serializable values in cachedir, one file per key.
+  Entries are valid for ttl seconds and only when the stored validator (e.g. the mtime or ETag of the source) matches.
+  When the cache grows beyond maxbytes the least recently used entries are removed.
+"""
+class DiskCache:
+
+  def __init__(self,cachedir,ttl=86400,maxbytes=64*1024*1024):
+    self.cachedir = cachedir
+    self.ttl = ttl
+    self.maxbytes = maxbytes
+    mkdir_p(cachedir)
+
+  """ Keys are hashed as the bytes they are, unicode keys as UTF-8 """
+  def _path(self,key):
+    return os.path.join(self.cachedir,hashlib.sha1(key if isinstance(key,str) else key.encode("utf-8")).hexdigest()+".json")
+
+  """ Keys and validators are stored and compared as unicode, json.load returns unicode strings """
+  def _text(self,value):
+    if isinstance(value,str):
+      return value.decode("utf-8","replace")
+    return value
+
+  def _remove(self,path):
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+  def get(self,key,validator=None):
+    path = self._path(key)
+    try:
+      with open(path,"r") as cachefile:
+        entry = json.load(cachefile)
+    except (IOError,OSError,ValueError):
+      return None
+    if entry.get("key") != self._text(key):
+      return None
+    if self.ttl != None and time.time() - entry.get("created",0) > self.ttl:
+      logging.debug("Cache entry expired for "+key)
+      self._remove(path)
+      return None
+    if entry.get("validator") != self._text(validator):
+      logging.debug("Cache entry outdated for "+key)
+      self._remove(path)
+      return None
+    """ Mark as recently used """
+    try:
+      os.utime(path,None)
+    except OSError:
+      pass
+    return entry.get("value")
+
+  def put(self,key,value,validator=None):
+    path = self._path(key)
+    tmppath = "%s.%d.%d.tmp" % (path,os.getpid(),id(value))
+    with open(tmppath,"w") as cachefile:
+      json.dump({"key":self._text(key),"validator":self._text(validator),"created":time.time(),"value":value},cachefile)
+    """ Rename is atomic, concurrent readers never see a partially written entry """
+    os.rename(tmppath,path)
+    self.evict()
+
+  def evict(self):
+    entries = []
+    totalbytes = 0
+    now = time.time()
+    for name in os.listdir(self.cachedir):
+      if not name.endswith(".json"):
+        continue
+      path = os.path.join(self.cachedir,name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      if self.ttl != None and now - stat.st_mtime > self.ttl:
+        self._remove(path)
+        continue
+      entries.append((stat.st_mtime,stat.st_size,path))
+      totalbytes = totalbytes + stat.st_size
+    entries.sort()
+    for mtime, size, path in entries:
+      if totalbytes <= self.maxbytes:
+        break
+      self._remove(path)
+      totalbytes = totalbytes - size
+
+"""
+  Content-addressed cache for files, e.g. rasterised feature grids.
+  The files are stored once by the SHA1 of their content in cachedir/objects, keys refer to them through a DiskCache in cachedir/refs.
+  When the objects grow beyond maxbytes the least recently used files are removed, keys referring to a removed file become misses.
+"""
+class FileCache:
+
+  def __init__(self,cachedir,maxbytes=1024*1024*1024,ttl=None):
+    self.objectdir = os.path.join(cachedir,"objects")
+    self.maxbytes = maxbytes
+    self.refs = DiskCache(os.path.join(cachedir,"refs"),ttl,16*1024*1024)
+    mkdir_p(self.objectdir)
+
+  def _hash(self,filename):
+    digest = hashlib.sha1()
+    with open(filename,"rb") as f:
+      while True:
+        block = f.read(1024*1024)
+        if not block:
+          break
+        digest.update(block)
+    return digest.hexdigest()
+
+  """
+    Copies the cached file for key to filename, returns False when there is none.
+  """
+  def get(self,key,filename,validator=None):
+    digest = self.refs.get(key,validator)
+    if digest == None:
+      return False
+    path = os.path.join(self.objectdir,digest)
+    try:
+      os.utime(path,None)
+      shutil.copyfile(path,filename)
+    except (IOError,OSError):
+      logging.debug("Cached file for "+key+" is gone")
+      return False
+    return True
+
+  def put(self,key,filename,validator=None):
+    digest = self._hash(filename)
+    path = os.path.join(self.objectdir,digest)
+    if os.path.isfile(path):
+      os.utime(path,None)
+    else:
+      tmppath = "%s.%d.tmp" % (path,os.getpid())
+      shutil.copyfile(filename,tmppath)
+      os.rename(tmppath,path)
+    self.refs.put(key,digest,validator)
+    self.evict()
+
+  def evict(self):
+    entries = []
+    totalbytes = 0
+    for name in os.listdir(self.objectdir):
+      if name.endswith(".tmp"):
+        continue
+      path = os.path.join(self.objectdir,name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((stat.st_mtime,stat.st_size,path))
+      totalbytes = totalbytes + stat.st_size
+    entries.sort()
+    for mtime, size, path in entries:
+      if totalbytes <= self.maxbytes:
+        break
+      logging.debug("Removing "+path+" from cache")
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      totalbytes = totalbytes - size
@@ -118,7 +118,8 @@ class Process(WPSProcess):
             outcsvfile=fileOutPath+self.csvnutsstatfilename.getValue(),
             callback=callback,
             tmpFolderPath=tmpFolderPath, 
-            homeFolderPath=home)        
+            homeFolderPath=home,
+            cacheFolderPath=home+"/.cache/iteratewcs")        
 
         #The final answer    
         self.netcdfnutsstatout.setValue(fileOutURL+"/"+self.netcdfnutsstatfilename.getValue());
@@ -1,4 +1,5 @@
 import urllib
+import urllib2
 import isodate 
 import time
 import netCDF4
@@ -6,15 +7,26 @@ from netCDF4 import MFDataset
 import sys
 from subprocess import PIPE, Popen, STDOUT
 from threading  import Thread
+import threading
+from multiprocessing.pool import ThreadPool
+import glob
+import collections
 import json
 import os
 import shutil
 from mkdir_p import *
 import zipfile
 from xml.sax.saxutils import escape
-from xml.dom import minidom
+try:
+  import xml.etree.cElementTree as ElementTree
+except ImportError:
+  import xml.etree.ElementTree as ElementTree
 import CGIRunner
+import ncutils
+import adaguccache
+import timeaxis
 import re
+import math
 import logging;
 #logging.basicConfig(level=logging.DEBUG)
   
@@ -79,22 +91,141 @@ def makezip(tmpdir,OUTFILE):
   zipf.close()
   os.chdir(currentpath)
   
-def callADAGUC(adagucexecutable,tmpdir,LOGFILE,url,filetogenerate):
+"""
+  Number of warm ADAGUC FastCGI workers kept for callADAGUC, this needs adagucserver built with FastCGI support.
+  With 0 a new adagucserver process is started for every call. Workers are replaced after ADAGUCWORKERMAXREQUESTS requests.
+"""
+ADAGUCWORKERS = 0
+ADAGUCWORKERMAXREQUESTS = 100
+
+def callADAGUC(adagucexecutable,tmpdir,LOGFILE,url,filetogenerate,adaguclog=None):
+  if(adaguclog == None):
+    adaguclog = tmpdir+"/adaguclog.log"
   env = {}
   if(LOGFILE != None):
     env["ADAGUC_ERRORFILE"]=LOGFILE
   try:
-    os.remove(tmpdir+"/adaguclog.log")
+    os.remove(adaguclog)
   except:
     pass
-  env["ADAGUC_LOGFILE"]=tmpdir+"/adaguclog.log"
-  return CGIRunner.CGIRunner().run([adagucexecutable],url,out = filetogenerate,extraenv=env, isLocalADAGUC = True)  
+  env["ADAGUC_LOGFILE"]=adaguclog
+  """ All ADAGUC calls in this process, also those of concurrent retrievals, share the process pool of CGIRunner """
+  if(ADAGUCWORKERS > 0):
+    workers = CGIRunner.getWorkerPool([adagucexecutable],ADAGUCWORKERS,ADAGUCWORKERMAXREQUESTS)
+    return workers.arun(url,filetogenerate,extraenv=env,isLocalADAGUC = True).get()
+  return CGIRunner.CGIRunner().arun([adagucexecutable],url,out = filetogenerate,extraenv=env, isLocalADAGUC = True).get()
+
+
+""" Seconds to wait for the HEAD request which validates a remote source """
+SOURCEVALIDATORTIMEOUT = 2
+
+""" Remote sources which could not be validated are not tried again for this many seconds """
+SOURCEVALIDATORRETRY = 24*3600
+
+""" Sources which could not be validated, with the time of the last try, shared by all calls in this python process """
+unvalidatedSources = {}
+unvalidatedSourcesLock = threading.Lock()
+
+""" OPeNDAP endpoints, e.g. THREDDS dodsC or Hyrax opendap paths, only answer for their DAS/DDS/DODS responses """
+OPENDAPPATTERN = re.compile(r"/(dodsC|opendap|dap)/",re.IGNORECASE)
+
+"""
+  Returns a string which changes when the source in WCSURL changes: the mtime and size for local files, the ETag or Last-Modified header for remote files.
+  Returns None when this can not be determined. Remote sources without ETag or Last-Modified are remembered for SOURCEVALIDATORRETRY seconds,
+  in this python process and in cache when a DiskCache is given, and are not asked again in that time.
+"""
+def getSourceValidator(WCSURL,cache=None):
+  source = None
+  for param in WCSURL.split("&"):
+    if param.lower().startswith("source="):
+      source = param[len("source="):]
+  if source == None:
+    return None
+  if os.path.isfile(source):
+    stat = os.stat(source)
+    return "mtime=%f;size=%d" % (stat.st_mtime,stat.st_size)
+  if not (source.startswith("http://") or source.startswith("https://")):
+    return None
+  cachekey = "unvalidated;"+source
+  with unvalidatedSourcesLock:
+    if time.time() - unvalidatedSources.get(source,0) < SOURCEVALIDATORRETRY:
+      return None
+  if cache != None and cache.get(cachekey) != None:
+    return None
+  urls = [source]
+  if OPENDAPPATTERN.search(source) != None:
+    urls.append(source+".das")
+  for url in urls:
+    try:
+      request = urllib2.Request(url)
+      request.get_method = lambda: "HEAD"
+      headers = urllib2.urlopen(request,timeout=SOURCEVALIDATORTIMEOUT).info()
+      etag = headers.getheader("ETag")
+      if etag != None:
+        return "etag="+etag
+      lastmodified = headers.getheader("Last-Modified")
+      if lastmodified != None:
+        return "lastmodified="+lastmodified
+    except Exception as e:
+      logging.debug("Unable to HEAD "+url+": "+str(e))
+  logging.debug("Unable to validate "+source+", not asking again for %d seconds" % SOURCEVALIDATORRETRY)
+  with unvalidatedSourcesLock:
+    unvalidatedSources[source] = time.time()
+  if cache != None:
+    cache.put(cachekey,True)
+  return None
+
+"""
+  Reads the time elements from a DescribeCoverage document incrementally, without building the whole document in memory.
+  Yields (name,text) for every gml:timePosition, gml:begin, gml:end and gml:duration element in document order.
+"""
+def iterTimeElements(filename):
+  parents = []
+  for event, elem in ElementTree.iterparse(filename,events=("start","end")):
+    if event == "start":
+      parents.append(elem)
+      continue
+    parents.pop()
+    name = elem.tag.split("}")[-1]
+    if name in ("timePosition","begin","end","duration"):
+      yield name, (elem.text or "").strip()
+    """ A finished element is always the last child of its parent, dropping it keeps memory use flat """
+    if len(parents) > 0:
+      del parents[-1][-1]
 
+"""
+  Describecoverage is done in order to retrieve the avaible dates in the coverage, these are returned as a timeaxis.
+  When a DiskCache is given, the dates are taken from the cache as long as the source did not change.
+  Sources for which getSourceValidator can not tell whether they changed are not cached, neither are empty time axes.
+"""
+def describeCoverage(adagucexecutable,tmpdir,LOGFILE,WCSURL,COVERAGE,cache=None):
+  cachekey = WCSURL+"&COVERAGE="+COVERAGE
+  validator = None
+  if(cache != None):
+    validator = getSourceValidator(WCSURL,cache)
+    if(validator == None):
+      logging.debug("Not using the DescribeCoverage cache, unable to tell whether the source changed for "+cachekey)
+      cache = None
+  if(cache != None):
+    cacheddates = cache.get(cachekey,validator)
+    if(cacheddates != None):
+      try:
+        founddates = timeaxis.axisFromDict(cacheddates)
+        logging.debug("DescribeCoverage taken from cache for "+cachekey)
+        return founddates
+      except ValueError:
+        pass
+  
+  founddates = requestDescribeCoverage(adagucexecutable,tmpdir,LOGFILE,WCSURL,COVERAGE)
+  
+  if(cache != None and len(founddates) > 0):
+    cache.put(cachekey,timeaxis.axisToDict(founddates),validator)
+  return founddates
 
 """
-  Describecoverage is done in order to retrieve the avaible dates in the coverage
+  Does the WCS DescribeCoverage request with ADAGUC and parses the dates from the response
 """
-def describeCoverage(adagucexecutable,tmpdir,LOGFILE,WCSURL,COVERAGE):
+def requestDescribeCoverage(adagucexecutable,tmpdir,LOGFILE,WCSURL,COVERAGE):
   
   filetogenerate = tmpdir+"/describecoverage.xml"
   url = WCSURL + "&SERVICE=WCS&REQUEST=DescribeCoverage&";
@@ -110,40 +241,149 @@ def describeCoverage(adagucexecutable,tmpdir,LOGFILE,WCSURL,COVERAGE):
     raise ValueError ("Succesfully completed WCS DescribeCoverage, but no data found. Log is: "+url+"\n"+adaguclog+"\n");
   
 
+  timepositions = []
+  period = {}
   try:
-    xmldoc = minidom.parse(filetogenerate)
+    for name, value in iterTimeElements(filetogenerate):
+      if name == "timePosition":
+        timepositions.append(value)
+      elif not name in period:
+        period[name] = value
   except:
     adaguclog = openfile(tmpdir+"/adaguclog.log");
     raise ValueError ("Succesfully completed WCS DescribeCoverage, but no data found for "+url+"\n"+adaguclog+"\n");
   try:
-    itemlist = xmldoc.getElementsByTagName('gml:timePosition')
-    if(len(itemlist)!=0):
-
-      listtoreturn  = [];
-      for s in itemlist:
-        listtoreturn.append(isodate.parse_datetime(s.childNodes[0].nodeValue))
-      return listtoreturn
+    if(len(timepositions)!=0):
+      return timeaxis.ExplicitTimeAxis([isodate.parse_datetime(s) for s in timepositions])
     else:
-      start_date = xmldoc.getElementsByTagName('gml:begin')[0].childNodes[0].nodeValue
-      end_date = xmldoc.getElementsByTagName('gml:end')[0].childNodes[0].nodeValue
-      res_date  = xmldoc.getElementsByTagName('gml:duration')[0].childNodes[0].nodeValue
+      start_date = period["begin"]
+      end_date = period["end"]
+      res_date  = period["duration"]
       logging.debug(start_date);
       logging.debug(end_date);
       logging.debug(res_date);
-      return list(daterange(isodate.parse_datetime(start_date),isodate.parse_datetime(end_date),isodate.parse_duration(res_date)));
+      return timeaxis.makeTimeAxis(isodate.parse_datetime(start_date),isodate.parse_datetime(end_date),isodate.parse_duration(res_date));
   except:
     pass
   
-  return []
+  return timeaxis.ExplicitTimeAxis([])
 
 
 def defaultCallback(message,percentage):
   return
+
+"""
+  Yields function(item) for all items in order, using the given pool.
+  At most window items are being processed or are waiting to be consumed at the same time.
+"""
+def orderedMap(pool,function,items,window):
+  pending = collections.deque()
+  for item in items:
+    pending.append(pool.apply_async(function,(item,)))
+    if len(pending) >= window:
+      yield pending.popleft().get()
+  while len(pending) > 0:
+    yield pending.popleft().get()
+
+""" Default number of bytes a single GetCoverage request is allowed to return """
+DEFAULTMAXBYTESPERREQUEST = 256*1024*1024
+
+""" Number of bytes assumed per grid cell, ADAGUC returns the datatype of the source which is mostly float """
+BYTESPERCELL = 4
+
+""" DescribeCoverage results are kept for a day, the cache directory is limited to 64MB """
+DESCRIBECOVERAGECACHETTL = 24*3600
+DESCRIBECOVERAGECACHEMAXBYTES = 64*1024*1024
+
+""" All dates of a request end up in QUERY_STRING, Linux refuses to start a process with an environment string over 128KB """
+MAXQUERYSTRINGBYTES = 128*1024
+
+""" Room in QUERY_STRING for everything besides the dates when the length of WCSURL is not known, and for the parameters added to WCSURL """
+QUERYSTRINGRESERVE = 16*1024
+QUERYSTRINGPARAMBYTES = 1024
+
+""" Length of one encoded date in the TIME parameter, including the encoded comma """
+BYTESPERDATE = len(urllib.quote_plus("2006-01-01T12:00:00Z,"))
+
+"""
+  Returns the number of dates which fit in one GetCoverage request when the rest of QUERY_STRING takes otherbytes.
+"""
+def getMaxDatesPerRequest(otherbytes=QUERYSTRINGRESERVE):
+  return max(1,(MAXQUERYSTRINGBYTES - len("QUERY_STRING=") - 1 - otherbytes) / BYTESPERDATE)
+
+MAXDATESPERREQUEST = getMaxDatesPerRequest()
+
+"""
+  Returns the GetCoverage URL for dates, all dates go in a single TIME parameter. Dates which are "*" are left out.
+"""
+def getCoverageURL(WCSURL,FORMAT,COVERAGE,dates,BBOX,CRS,RESX=None,RESY=None,WIDTH=None,HEIGHT=None):
+  url = WCSURL + "&SERVICE=WCS&REQUEST=GetCoverage&";
+  url = url + "FORMAT="+urllib.quote_plus(FORMAT)+"&";
+  url = url + "COVERAGE="+urllib.quote_plus(COVERAGE)+"&";
+  
+  logging.debug("WCS GetCoverage URL: "+str(url));
+  
+  wcstime = ",".join(time.strftime("%Y-%m-%dT%H:%M:%SZ", wcsdate.timetuple()) for wcsdate in dates if wcsdate != "*")
+  if wcstime != "":
+    url = url + "TIME="+urllib.quote_plus(wcstime)+"&";
+      
+  url = url + "BBOX="+BBOX+"&";
+  if RESX != None:
+    url = url + "RESX="+str(RESX)+"&";
+  if RESY != None:
+    url = url + "RESY="+str(RESY)+"&";
+  if WIDTH != None:
+    url = url + "WIDTH="+str(WIDTH)+"&";
+  if HEIGHT != None:
+    url = url + "HEIGHT="+str(HEIGHT)+"&";
+    
+  url = url + "CRS="+urllib.quote_plus(CRS)+"&";
+  return url
+
+"""
+  Returns the number of grid cells per date for the requested grid, based on WIDTH/HEIGHT or on RESX/RESY and BBOX.
+  Returns None when the grid size can not be determined.
+"""
+def getGridSize(BBOX,RESX,RESY,WIDTH,HEIGHT):
+  try:
+    bbox = [float(v) for v in BBOX.split(",")]
+    width = WIDTH
+    height = HEIGHT
+    if width == None and RESX != None:
+      width = math.ceil(abs(bbox[2]-bbox[0])/float(RESX))
+    if height == None and RESY != None:
+      height = math.ceil(abs(bbox[3]-bbox[1])/float(RESY))
+    if width == None or height == None:
+      return None
+    return int(width)*int(height)
+  except:
+    return None
+
+"""
+  Determines how many dates are combined into one GetCoverage request.
+  Small grids go in a few large requests, large grids are split so that a single request stays within maxbytes.
+"""
+def getDatesPerRequest(FORMAT,numdates,gridsize,maxbytes,maxworkers=1,maxdates=MAXDATESPERREQUEST):
+  if(FORMAT != "netcdf"):
+    return 1
+  if(gridsize == None or gridsize <= 0):
+    return 8
+  datesperrequest = int(maxbytes / (gridsize*BYTESPERCELL))
+  if(maxworkers > 1):
+    """ Make sure every worker has something to do """
+    datesperrequest = min(datesperrequest, int(math.ceil(numdates/float(maxworkers))))
+  return max(1,min(datesperrequest,numdates,maxdates))
   
 """
 This requires a working ADAGUC server in the PATH environment, ADAGUC_CONFIG environment variable must point to ADAGUC's config file.
+MAXWORKERS sets the number of GetCoverage requests which are allowed to run at the same time.
+All ADAGUC processes in this python process share the limit of CGIRunner (MAXCONCURRENTPROCESSES), it is raised to MAXWORKERS when lower.
+MAXBYTESPERREQUEST sets the budget in bytes for a single GetCoverage request, defaults to DEFAULTMAXBYTESPERREQUEST.
+For netcdf the results are aggregated over time into OUTFILE, CHUNKSIZES is a dict with chunk lengths per dimension name and COMPLEVEL the deflate level (0 is no compression).
+With STREAMING each retrieved netcdf file is appended to OUTFILE and removed right away, only a few files are kept in TMP at any time.
+CACHEDIR is a directory where DescribeCoverage results are kept between calls, None disables the cache.
 """
-def iteratewcs(TIME = "",BBOX = "-180,-90,180,90",CRS = "EPSG:4326",RESX=None,RESY=None,WIDTH=None, HEIGHT= None,WCSURL="",TMP=".",COVERAGE="pr",LOGFILE=None,OUTFILE="out.nc",FORMAT="netcdf",CALLBACK=defaultCallback):
+def iteratewcs(TIME = "",BBOX = "-180,-90,180,90",CRS = "EPSG:4326",RESX=None,RESY=None,WIDTH=None, HEIGHT= None,WCSURL="",TMP=".",COVERAGE="pr",LOGFILE=None,OUTFILE="out.nc",FORMAT="netcdf",CALLBACK=defaultCallback,MAXWORKERS=1,MAXBYTESPERREQUEST=None,CHUNKSIZES=None,COMPLEVEL=0,STREAMING=False,CACHEDIR=None):
   adagucexecutable='adagucserver'
   
   """ Check if adagucserver is in the path """
@@ -157,7 +397,10 @@ def iteratewcs(TIME = "",BBOX = "-180,-90,180,90",CRS = "EPSG:4326",RESX=None,RE
   
   """ Determine which dates to do based on describe coverage call"""
   CALLBACK("Starting WCS DescribeCoverage request",1)
-  founddates = describeCoverage(adagucexecutable,tmpdir,LOGFILE,WCSURL,COVERAGE);
+  cache = None
+  if(CACHEDIR != None):
+    cache = adaguccache.DiskCache(CACHEDIR,DESCRIBECOVERAGECACHETTL,DESCRIBECOVERAGECACHEMAXBYTES)
+  founddates = describeCoverage(adagucexecutable,tmpdir,LOGFILE,WCSURL,COVERAGE,cache);
   
   start_date=""
   end_date=""
@@ -180,9 +423,7 @@ def iteratewcs(TIME = "",BBOX = "-180,-90,180,90",CRS = "EPSG:4326",RESX=None,RE
   
   
   if len(founddates) > 0:
-        for date in founddates:
-            if(date>=start_date and date<=end_date):
-                datestodo.append(date)
+    datestodo = founddates.select(start_date,end_date)
   else:
     datestodo.append("*");
   
@@ -199,37 +440,14 @@ def iteratewcs(TIME = "",BBOX = "-180,-90,180,90",CRS = "EPSG:4326",RESX=None,RE
   
   def makeGetCoverage(single_date):
     filetime=""
-    wcstime=""
     messagetime = ""
     
-    url = WCSURL + "&SERVICE=WCS&REQUEST=GetCoverage&";
-    url = url + "FORMAT="+urllib.quote_plus(FORMAT)+"&";
-    url = url + "COVERAGE="+urllib.quote_plus(COVERAGE)+"&";
-    
-    logging.debug("WCS GetCoverage URL: "+str(url));
-    
-    for j in range(0,len(single_date)):
-      wcsdate = single_date[j]
+    for wcsdate in single_date:
       if wcsdate != "*":
-        if(j>0):
-          wcstime=wcstime + ","
-        wcstime=wcstime + time.strftime("%Y-%m-%dT%H:%M:%SZ", wcsdate.timetuple())
         filetime=time.strftime("%Y%m%dT%H%M%SZ", single_date[0].timetuple()) + '-'  + time.strftime("%Y%m%dT%H%M%SZ", single_date[-1].timetuple())
         messagetime=time.strftime("%Y%m%dT%H%M%SZ", single_date[0].timetuple()) 
-        url = url + "TIME="+urllib.quote_plus(wcstime)+"&";
-        
-        
-    url = url + "BBOX="+BBOX+"&";
-    if RESX != None:
-      url = url + "RESX="+str(RESX)+"&";
-    if RESY != None:
-      url = url + "RESY="+str(RESY)+"&";
-    if WIDTH != None:
-      url = url + "WIDTH="+str(WIDTH)+"&";
-    if HEIGHT != None:
-      url = url + "HEIGHT="+str(HEIGHT)+"&";
-      
-    url = url + "CRS="+urllib.quote_plus(CRS)+"&";
+    
+    url = getCoverageURL(WCSURL,FORMAT,COVERAGE,single_date,BBOX,CRS,RESX,RESY,WIDTH,HEIGHT)
     logging.debug(url);
     filetogenerate = tmpdir+"/file"+filetime
     
@@ -240,68 +458,111 @@ def iteratewcs(TIME = "",BBOX = "-180,-90,180,90",CRS = "EPSG:4326",RESX=None,RE
     if(FORMAT == "aaigrid"):
       filetogenerate = filetogenerate  + ".grd"
     
-    status = callADAGUC(adagucexecutable,tmpdir,LOGFILE,url,filetogenerate);
+    """ Each worker thread writes to its own ADAGUC log file """
+    adaguclog = tmpdir+"/adaguclog.log"
+    if(MAXWORKERS > 1):
+      adaguclog = tmpdir+"/adaguclog-"+threading.current_thread().name+".log"
+    
+    starttime = time.time()
+    status = callADAGUC(adagucexecutable,tmpdir,LOGFILE,url,filetogenerate,adaguclog);
     
     if(status != 0):
-      adaguclog = openfile(tmpdir+"/adaguclog.log");
-      raise ValueError( "Unable to retrieve "+url+"\n"+adaguclog+"\n");
+      raise ValueError( "Unable to retrieve "+url+"\n"+openfile(adaguclog)+"\n");
     
     if(os.path.isfile(filetogenerate) != True):
-      adaguclog = openfile(tmpdir+"/adaguclog.log");
-      raise ValueError ("Succesfully completed WCS GetCoverage, but no data found for "+url+"\n"+adaguclog+"\n");
+      raise ValueError ("Succesfully completed WCS GetCoverage, but no data found for "+url+"\n"+openfile(adaguclog)+"\n");
+    
+    numbytes = os.path.getsize(filetogenerate)
+    logging.info("GetCoverage for %d dates took %.3f seconds and returned %d bytes (%d bytes per date, budget is %d bytes)" % (len(single_date),time.time()-starttime,numbytes,numbytes/len(single_date),maxbytes))
    
-    if(CALLBACK==None):
-      print str(int((float(datesdone)/numdatestodo)*90.))
-    else:
-      CALLBACK("Processing %s " % messagetime,((float(datesdone)/float(numdatestodo))*90.))
-    return filetogenerate
+    return filetogenerate, messagetime
   
   """ Make the WCS GetCoverage calls """
   grouped_dates = []
-  numberOfDatesInGroup = 0;
-  maxRequestsAtOnce = 1
-  if(FORMAT == "netcdf"):
-    maxRequestsAtOnce = 8
+  groups = []
+  maxbytes = MAXBYTESPERREQUEST
+  if(maxbytes == None):
+    maxbytes = DEFAULTMAXBYTESPERREQUEST
+  gridsize = getGridSize(BBOX,RESX,RESY,WIDTH,HEIGHT)
+  otherbytes = len(WCSURL)+len(COVERAGE)+len(BBOX)+len(urllib.quote_plus(CRS))+QUERYSTRINGPARAMBYTES
+  CGIRunner.setMinimumConcurrentProcesses(MAXWORKERS)
+  maxRequestsAtOnce = getDatesPerRequest(FORMAT,numdatestodo,gridsize,maxbytes,MAXWORKERS,getMaxDatesPerRequest(otherbytes))
+  logging.info("Requesting %d dates in groups of %d dates for a grid of %s cells" % (numdatestodo,maxRequestsAtOnce,str(gridsize)))
   for single_date in datestodo:
     grouped_dates.append(single_date) 
-    datesdone=datesdone+1;
     if (len(grouped_dates) >= maxRequestsAtOnce):
-      filetogenerate = makeGetCoverage(grouped_dates)    
+      groups.append(grouped_dates)
       grouped_dates = []
     
   if len(grouped_dates) > 0:
-    filetogenerate = makeGetCoverage(grouped_dates)
- 
-  def monitor2(line):
-    dolog(tmpdir,line);
-    try:
-      data = json.loads(line)
-      if(CALLBACK == None):
-        print float(data["percentage"])*(1./10)+90
+    groups.append(grouped_dates)
+  
+  """ Groups are retrieved concurrently, results come back in the same order as the groups """
+  streaming = (STREAMING == True and FORMAT == "netcdf" and len(groups) > 1)
+  pool = None
+  aggregator = None
+  if(streaming):
+    """ Retrieval continues in the background while finished files are appended to OUTFILE and removed """
+    pool = ThreadPool(max(1,min(MAXWORKERS,len(groups))))
+    results = orderedMap(pool, makeGetCoverage, groups, max(1,MAXWORKERS)+1)
+    aggregator = ncutils.TimeAggregator(OUTFILE,numdatestodo,CHUNKSIZES,COMPLEVEL > 0,COMPLEVEL)
+  elif(MAXWORKERS > 1 and len(groups) > 1):
+    pool = ThreadPool(min(MAXWORKERS,len(groups)))
+    results = pool.imap(makeGetCoverage, groups)
+  else:
+    results = (makeGetCoverage(group) for group in groups)
+  
+  try:
+    for group in groups:
+      filetogenerate, messagetime = next(results)
+      if(aggregator != None):
+        try:
+          aggregator.append(filetogenerate)
+        except Exception as e:
+          raise ValueError('Unable to aggregate '+filetogenerate+' into '+str(OUTFILE)+": "+str(e))
+        os.remove(filetogenerate)
+      datesdone=datesdone+len(group);
+      if(CALLBACK==None):
+        print str(int((float(datesdone)/numdatestodo)*90.))
       else:
-        CALLBACK("Processing % " % data["message"],float(data["percentage"])*(1./10)+90)
-    except:
-      CALLBACK(line,50)
+        CALLBACK("Processing %s " % messagetime,((float(datesdone)/float(numdatestodo))*90.))
+    if(aggregator != None):
+      aggregator.close()
+      aggregator = None
+  finally:
+    if(pool != None):
+      pool.terminate()
+      pool.join()
+    if(aggregator != None):
+      """ Do not leave a partially aggregated file behind """
+      aggregator.close()
+      try:
+        os.remove(OUTFILE)
+      except:
+        pass
+  
+  for workerlog in glob.glob(tmpdir+"/adaguclog-*.log"):
+    os.remove(workerlog)
+ 
+  def aggregateCallback(message,percentage):
+    if(CALLBACK == None):
+      print float(percentage)*(1./10)+90
+    else:
+      CALLBACK("Processing %s" % message,float(percentage)*(1./10)+90)
   
   
   """ If it is netcdf, make a new big netcdf file """
   if(FORMAT == "netcdf"):
-    if datesdone == 1:
+    if streaming:
+      if(CALLBACK != None):
+        CALLBACK("Aggregated %d dates into %s" % (numdatestodo,OUTFILE),100)
+    elif len(groups) == 1:
       shutil.copyfile(filetogenerate ,OUTFILE)
-    if datesdone > 1:
-      cleanlog(tmpdir);
-      dolog(tmpdir,tmpdir)
-      dolog(tmpdir,OUTFILE)
-      cmds=['aggregate_time',tmpdir,OUTFILE]
-      dolog(tmpdir,cmds)
-      status = CGIRunner.CGIRunner().startProcess(cmds,monitor2)
-      
-      if(status != 0):
-        dolog(tmpdir,"statuscode: "+str(status))
-        
-        data = getlog(tmpdir)
-        
-        raise ValueError('Unable to aggregate: statuscode='+str(status)+"\n"+data)
+    else:
+      try:
+        ncutils.aggregateTime(glob.glob(tmpdir+"/file*.nc"),OUTFILE,chunksizes=CHUNKSIZES,zlib=(COMPLEVEL > 0),complevel=COMPLEVEL,callback=aggregateCallback)
+      except Exception as e:
+        raise ValueError('Unable to aggregate into '+str(OUTFILE)+": "+str(e))
       
   else:
     CALLBACK("zipping to %s" % (OUTFILE), 95);
@@ -0,0 +1,242 @@
+"""
+Helpers to read and write netCDF files with netCDF4, used instead of external ADAGUC tools.
+"""
+import os
+import logging
+import numpy
+import netCDF4
+
+def defaultCallback(message,percentage):
+  return
+
+"""
+  Returns the name of the time dimension of a dataset: the unlimited dimension or else the dimension called time.
+"""
+def getTimeDimension(dataset):
+  for name, dimension in dataset.dimensions.items():
+    if dimension.isunlimited():
+      return name
+  if "time" in dataset.dimensions:
+    return "time"
+  return None
+
+""" Maximum size of a slab read and written at once when copying variables """
+DEFAULTSLABBYTES = 64*1024*1024
+
+"""
+  Copies the dimensions of src to dst, unlimited dimensions stay unlimited. Dimensions which already exist in dst are skipped.
+"""
+def copyDimensions(src,dst):
+  for name, dimension in src.dimensions.items():
+    if not name in dst.dimensions:
+      dst.createDimension(name, None if dimension.isunlimited() else len(dimension))
+
+"""
+  Copies the data of srcvar to dstvar in slabs along the first dimension of at most maxbytes, values are copied without mask and scale conversion.
+"""
+def copyVariableData(srcvar,dstvar,maxbytes=DEFAULTSLABBYTES):
+  """ The Variable objects are shared with the caller, their mask and scale settings are restored afterwards """
+  srcsettings = (getattr(srcvar,"mask",True),getattr(srcvar,"scale",True))
+  dstsettings = (getattr(dstvar,"mask",True),getattr(dstvar,"scale",True))
+  srcvar.set_auto_maskandscale(False)
+  dstvar.set_auto_maskandscale(False)
+  try:
+    shape = srcvar.shape
+    if len(shape) == 0:
+      dstvar.assignValue(srcvar.getValue())
+      return
+    itemsize = 8 if srcvar.dtype == str else srcvar.dtype.itemsize
+    rowbytes = max(1,int(numpy.prod(shape[1:]))*itemsize)
+    step = max(1,int(maxbytes)//rowbytes)
+    for start in range(0,shape[0],step):
+      """ The stop is clipped, an open slice on an unlimited dimension would take the step as length """
+      stop = min(start+step,shape[0])
+      dstvar[start:stop] = srcvar[start:stop]
+  finally:
+    srcvar.set_auto_mask(srcsettings[0])
+    srcvar.set_auto_scale(srcsettings[1])
+    dstvar.set_auto_mask(dstsettings[0])
+    dstvar.set_auto_scale(dstsettings[1])
+
+"""
+  Creates a copy of a netCDF variable in dst with the same dimensions, attributes, fill value, chunking and compression.
+  The dimensions must exist in dst, see copyDimensions. With copydata=False only the definition is copied.
+"""
+def copyVariable(srcvar,dst,name=None,copydata=True,maxbytes=DEFAULTSLABBYTES):
+  if name == None:
+    name = srcvar.name
+  attrs = dict((k,srcvar.getncattr(k)) for k in srcvar.ncattrs())
+  kwargs = {}
+  if "_FillValue" in attrs:
+    kwargs["fill_value"] = attrs.pop("_FillValue")
+  if dst.data_model.startswith("NETCDF4") and srcvar.dtype != str and len(srcvar.dimensions) > 0:
+    chunking = srcvar.chunking()
+    if isinstance(chunking,list):
+      kwargs["chunksizes"] = chunking
+    filters = srcvar.filters()
+    if filters != None:
+      kwargs["zlib"] = filters.get("zlib",False)
+      kwargs["complevel"] = filters.get("complevel",4)
+      kwargs["shuffle"] = filters.get("shuffle",True)
+  dstvar = dst.createVariable(name,srcvar.datatype,srcvar.dimensions,**kwargs)
+  dstvar.setncatts(attrs)
+  if copydata:
+    copyVariableData(srcvar,dstvar,maxbytes)
+  return dstvar
+
+"""
+  Returns the chunksizes tuple for a variable, chunksizes is a dict with a chunk length per dimension name.
+  Dimensions not in the dict get their full length, the time dimension gets length 1.
+"""
+def getChunkSizes(dataset,dimensions,chunksizes,timedim=None):
+  if chunksizes == None or len(dimensions) == 0:
+    return None
+  sizes = []
+  for name in dimensions:
+    if name in chunksizes:
+      sizes.append(int(chunksizes[name]))
+    elif name == timedim:
+      sizes.append(1)
+    else:
+      sizes.append(max(1,len(dataset.dimensions[name])))
+  return tuple(sizes)
+
+"""
+  Merges netCDF files along the time dimension into a single file.
+  Files are appended one at a time, for each variable one slab per input file is read and written.
+  When the total number of timesteps is known beforehand the unlimited time axis is preallocated.
+"""
+class TimeAggregator:
+
+  def __init__(self,outfile,numtimesteps=None,chunksizes=None,zlib=False,complevel=4):
+    self.outfile = outfile
+    self.numtimesteps = numtimesteps
+    self.chunksizes = chunksizes
+    self.zlib = zlib
+    self.complevel = complevel
+    self.nc_out = None
+    self.timedim = None
+    self.offset = 0
+
+  def _create(self,nc_in):
+    self.timedim = getTimeDimension(nc_in)
+    if self.timedim == None:
+      raise ValueError("No time dimension found in "+str(nc_in.filepath()))
+    dataformat = nc_in.data_model
+    if (self.zlib == True or self.chunksizes != None) and not dataformat.startswith("NETCDF4"):
+      dataformat = "NETCDF4_CLASSIC"
+    self.nc_out = netCDF4.Dataset(self.outfile,'w',format=dataformat)
+    self.nc_out.setncatts(dict((k,nc_in.getncattr(k)) for k in nc_in.ncattrs()))
+    for name, dimension in nc_in.dimensions.items():
+      if name == self.timedim:
+        self.nc_out.createDimension(name, None)
+      else:
+        self.nc_out.createDimension(name, len(dimension))
+    for name, invar in nc_in.variables.items():
+      kwargs = {}
+      attrs = dict((k,invar.getncattr(k)) for k in invar.ncattrs())
+      if "_FillValue" in attrs:
+        kwargs["fill_value"] = attrs.pop("_FillValue")
+      if invar.dtype != str and dataformat.startswith("NETCDF4"):
+        kwargs["zlib"] = self.zlib
+        kwargs["complevel"] = self.complevel
+        chunksizes = getChunkSizes(nc_in,invar.dimensions,self.chunksizes,self.timedim)
+        if chunksizes != None:
+          kwargs["chunksizes"] = chunksizes
+      outvar = self.nc_out.createVariable(name,invar.datatype,invar.dimensions,**kwargs)
+      outvar.setncatts(attrs)
+    self.timeunits = None
+    if self.timedim in self.nc_out.variables:
+      timevar = self.nc_out.variables[self.timedim]
+      try:
+        self.timeunits = timevar.units
+      except AttributeError:
+        pass
+      if self.numtimesteps != None and self.numtimesteps > 0:
+        """ Writing the last element extends the unlimited dimension at once """
+        timevar.set_auto_maskandscale(False)
+        timevar[self.numtimesteps-1] = numpy.array(netCDF4.default_fillvals.get(timevar.dtype.str[1:],0),dtype=timevar.dtype)
+
+  """
+    Time values are converted to the units of the first file when the units of an input file differ.
+  """
+  def _convertTime(self,invar,data):
+    try:
+      units = invar.units
+    except AttributeError:
+      return data
+    if self.timeunits == None or units == self.timeunits:
+      return data
+    try:
+      calendar = invar.calendar
+    except AttributeError:
+      calendar = "standard"
+    return netCDF4.date2num(netCDF4.num2date(data,units,calendar),self.timeunits,calendar)
+
+  def append(self,filename):
+    nc_in = netCDF4.Dataset(filename,'r')
+    try:
+      if self.nc_out == None:
+        self._create(nc_in)
+      numsteps = 1
+      if self.timedim in nc_in.dimensions:
+        numsteps = len(nc_in.dimensions[self.timedim])
+      for name, invar in nc_in.variables.items():
+        if not name in self.nc_out.variables:
+          raise ValueError("Variable "+name+" from "+filename+" is not in the first aggregated file")
+        outvar = self.nc_out.variables[name]
+        invar.set_auto_maskandscale(False)
+        outvar.set_auto_maskandscale(False)
+        if self.timedim in invar.dimensions:
+          index = [slice(None)]*len(invar.dimensions)
+          index[invar.dimensions.index(self.timedim)] = slice(self.offset,self.offset+numsteps)
+          data = invar[:]
+          if name == self.timedim:
+            data = self._convertTime(invar,data)
+          outvar[tuple(index)] = data
+        elif self.offset == 0:
+          """ Variables without time are taken from the first file """
+          if len(invar.dimensions) == 0:
+            outvar.assignValue(invar.getValue())
+          else:
+            outvar[:] = invar[:]
+      self.offset = self.offset + numsteps
+    finally:
+      nc_in.close()
+
+  def close(self):
+    if self.nc_out == None:
+      return
+    if self.numtimesteps != None and self.offset != self.numtimesteps:
+      logging.warning("Aggregated %d timesteps into %s, %d were expected" % (self.offset,self.outfile,self.numtimesteps))
+    self.nc_out.close()
+    self.nc_out = None
+
+"""
+  Aggregates netCDF files along the time dimension into outfile, this replaces ADAGUC's aggregate_time tool.
+  The files are appended in filename order, iteratewcs names its files after their first and last date.
+  chunksizes is a dict with chunk lengths per dimension name, zlib and complevel set the compression.
+  callback(message,percentage) is called with a percentage between 0 and 100.
+"""
+def aggregateTime(filenames,outfile,chunksizes=None,zlib=False,complevel=4,callback=defaultCallback):
+  filenames = sorted(filenames)
+  if len(filenames) == 0:
+    raise ValueError("No files to aggregate into "+str(outfile))
+  numtimesteps = 0
+  for filename in filenames:
+    nc_in = netCDF4.Dataset(filename,'r')
+    try:
+      timedim = getTimeDimension(nc_in)
+      if timedim != None:
+        numtimesteps = numtimesteps + len(nc_in.dimensions[timedim])
+    finally:
+      nc_in.close()
+  aggregator = TimeAggregator(outfile,numtimesteps,chunksizes,zlib,complevel)
+  try:
+    for j in range(0,len(filenames)):
+      callback("Aggregating %s" % os.path.basename(filenames[j]),(float(j)/len(filenames))*100.)
+      aggregator.append(filenames[j])
+  finally:
+    aggregator.close()
+  callback("Aggregated %d timesteps" % numtimesteps,100.)
+  return numtimesteps
@@ -473,6 +473,219 @@ Julian Day is a fractional day with a resolution of 1 second.
 
     return datetime(year,month,int(days),int(hours),int(minutes),int(seconds),-1, int(dayofyr))
 
+def _DateFieldsFromDates(dates):
+    """
+
+returns integer arrays (year,month,day,hour,minute,second) for an array of
+'datetime-like' objects or an array of numpy datetime64 values.
+Seconds are truncated, like in JulianDayFromDate.
+
+    """
+    dates = numpy.asarray(dates)
+    if dates.dtype.kind == 'M':
+        seconds = dates.astype('M8[s]')
+        days = seconds.astype('M8[D]')
+        months = seconds.astype('M8[M]')
+        years = months.astype('M8[Y]').astype(numpy.int64)
+        month = months.astype(numpy.int64) - 12*years + 1
+        day = (days - months.astype('M8[D]')).astype(numpy.int64) + 1
+        secofday = (seconds - days.astype('M8[s]')).astype(numpy.int64)
+        return years + 1970, month, day, secofday//3600, (secofday//60)%60, secofday%60
+    fields = numpy.array([(d.year,d.month,d.day,d.hour,d.minute,d.second) for d in dates.flat],numpy.int64).reshape(dates.shape+(6,))
+    return tuple(fields[...,j] for j in range(6))
+
+def _JulianDayFromFields(year,month,day,hour,minute,second,calendar='standard'):
+    """
+
+creates fractional Julian Days from integer arrays of date fields, for all
+calendars. This is the array version of JulianDayFromDate, _NoLeapDayFromDate,
+_AllLeapFromDate and _360DayFromDate, with the same floating point operations
+in the same order so the results are identical.
+
+    """
+    year = numpy.asarray(year,numpy.int64)
+    month = numpy.asarray(month,numpy.int64)
+    # Convert time to fractions of a day
+    day = day + hour/24.0 + minute/1440.0 + second/86400.0
+
+    if calendar == '360_day':
+        return numpy.trunc(360. * (year + 4716)) + numpy.trunc(30. * (month - 1)) + day
+
+    # Start Meeus algorithm (variables are in his notation)
+    early = month < 3
+    month = numpy.where(early, month + 12, month)
+    year = numpy.where(early, year - 1, year)
+
+    if calendar in ['noleap','365_day']:
+        return numpy.trunc(365. * (year + 4716)) + numpy.trunc(30.6001 * (month + 1)) + day - 1524.5
+    if calendar in ['all_leap','366_day']:
+        return numpy.trunc(366. * (year + 4716)) + numpy.trunc(30.6001 * (month + 1)) + day - 1524.5
+
+    A = year//100
+    jd = 365.*year + numpy.trunc(0.25 * year + 2000.) + numpy.trunc(30.6001 * (month + 1)) + \
+         day + 1718994.5
+    if calendar in ['standard','gregorian']:
+        if numpy.any((jd >= 2299160.5) & (jd < 2299170.5)):
+            raise ValueError('impossible date (falls in gap between end of Julian calendar and beginning of Gregorian calendar')
+        B = numpy.where(jd >= 2299170.5, 2 - A + A//4, 0)
+    elif calendar == 'proleptic_gregorian':
+        B = 2 - A + A//4
+    elif calendar == 'julian':
+        B = 0
+    else:
+        raise ValueError('unknown calendar, must be one of julian,standard,gregorian,proleptic_gregorian, got %s' % calendar)
+    return jd + B
+
+def _TimeFromDayFraction(day):
+    """
+
+splits fractional days into integer arrays (days,hours,minutes,seconds),
+seconds are rounded half away from zero like the python 2 round.
+
+    """
+    (dfrac, days) = numpy.modf(day)
+    (hfrac, hours) = numpy.modf(dfrac * 24.0)
+    (mfrac, minutes) = numpy.modf(hfrac * 60.0)
+    seconds = mfrac * 60.0
+    rounded = numpy.floor(seconds)
+    seconds = rounded + (seconds - rounded >= 0.5)
+
+    carry = seconds > 59
+    seconds = numpy.where(carry, 0, seconds)
+    minutes = minutes + carry
+    carry = minutes > 59
+    minutes = numpy.where(carry, 0, minutes)
+    hours = hours + carry
+    carry = hours > 23
+    hours = numpy.where(carry, 0, hours)
+    days = days + carry
+    return days.astype(numpy.int64), hours.astype(numpy.int64), minutes.astype(numpy.int64), seconds.astype(numpy.int64)
+
+def _DateFieldsFromJulianDay(JD,calendar='standard'):
+    """
+
+returns integer arrays (year,month,day,hour,minute,second,dayofwk,dayofyr)
+given an array of Julian Days, for all calendars. This is the array version
+of DateFromJulianDay, _DateFromNoLeapDay, _DateFromAllLeap and
+_DateFrom360Day and gives the same fields.
+
+    """
+    JD = numpy.asarray(JD,dtype='d')
+    if numpy.any(JD < 0):
+        raise ValueError('Julian Day must be positive')
+
+    if calendar == '360_day':
+        (F, Z) = numpy.modf(JD)
+        year = numpy.trunc((Z-0.5)/360.).astype(numpy.int64) - 4716
+        dayofyr = Z - (year+4716)*360
+        month = numpy.trunc((dayofyr-0.5)/30).astype(numpy.int64)+1
+        days, hours, minutes, seconds = _TimeFromDayFraction(dayofyr - (month-1)*30 + F)
+        return year, month, days, hours, minutes, seconds, numpy.zeros_like(year)-1, numpy.trunc(dayofyr).astype(numpy.int64)
+
+    dayofwk = numpy.trunc(JD + 1.5).astype(numpy.int64) % 7
+    (F, Z) = numpy.modf(JD + 0.5)
+    Z = Z.astype(numpy.int64)
+    if calendar in ['standard','gregorian','proleptic_gregorian']:
+        alpha = numpy.trunc(((Z - 1867216.)-0.25)/36524.25).astype(numpy.int64)
+        A = Z + 1 + alpha - numpy.trunc(0.25*alpha).astype(numpy.int64)
+        if calendar != 'proleptic_gregorian':
+            A = numpy.where(JD < 2299160.5, Z, A)
+    elif calendar in ['julian','noleap','365_day','all_leap','366_day']:
+        A = Z
+    else:
+        raise ValueError('unknown calendar, must be one of julian,standard,gregorian,proleptic_gregorian, got %s' % calendar)
+    B = A + 1524
+
+    if calendar in ['noleap','365_day','all_leap','366_day']:
+        daysinyear = 365. if calendar in ['noleap','365_day'] else 366.
+        C = numpy.trunc((B - 122.1)/daysinyear).astype(numpy.int64)
+        D = numpy.trunc(daysinyear * C).astype(numpy.int64)
+        E = numpy.trunc((B - D)/30.6001).astype(numpy.int64)
+        day = B - D - numpy.trunc(30.6001 * E).astype(numpy.int64) + F
+        nday = B-D-123
+        dayofyr = numpy.where(nday <= 305, nday+60, nday-305)
+        month = numpy.where(E < 14, E - 1, E - 13)
+        if daysinyear == 366.:
+            dayofyr = dayofyr + (month > 2)
+        year = numpy.where(month > 2, C - 4716, C - 4715)
+        days, hours, minutes, seconds = _TimeFromDayFraction(day)
+        return year, month, days, hours, minutes, seconds, dayofwk, dayofyr
+
+    C = numpy.trunc(6680.+((B-2439870.)-122.1)/365.25).astype(numpy.int64)
+    D = 365*C + numpy.trunc(0.25 * C).astype(numpy.int64)
+    E = numpy.trunc((B - D)/30.6001).astype(numpy.int64)
+
+    # Convert to date
+    day = B - D - numpy.trunc(30.6001 * E).astype(numpy.int64) + F
+    nday = B-D-123
+    dayofyr = numpy.where(nday <= 305, nday+60, nday-305)
+    month = E - 1
+    month = numpy.where(month > 12, month - 12, month)
+    year = C - 4715
+    year = numpy.where(month > 2, year - 1, year)
+    year = numpy.where(year <= 0, year - 1, year)
+
+    # a leap year?
+    leap = (year % 4 == 0)
+    if calendar == 'proleptic_gregorian':
+        gregorian = numpy.ones(JD.shape,bool)
+    elif calendar in ['standard','gregorian']:
+        gregorian = JD >= 2299160.5
+    else:
+        gregorian = numpy.zeros(JD.shape,bool)
+    leap = leap & ~(gregorian & (year % 100 == 0) & (year % 400 != 0))
+    dayofyr = dayofyr + (leap & (month > 2))
+
+    days, hours, minutes, seconds = _TimeFromDayFraction(day)
+
+    # if days exceeds number allowed in a month, flip to next month.
+    # monthrange always uses the proleptic gregorian leap years.
+    isleap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    daysinmonth = numpy.array([0,31,28,31,30,31,30,31,31,30,31,30,31])[month] + (isleap & (month == 2))
+    flip = days > daysinmonth
+    days = numpy.where(flip, 1, days)
+    month = month + flip
+    year = numpy.where(month > 12, year + 1, year)
+    month = numpy.where(month > 12, 1, month)
+    return year, month, days, hours, minutes, seconds, dayofwk, dayofyr
+
+def _DatesFromJulianDay(JD,calendar='standard'):
+    """
+
+returns a list of 'datetime-like' objects given an array of Julian Days,
+the array version of DateFromJulianDay and its calendar variants.
+Falls back to the scalar functions for dates outside the years 1-9999,
+where those raise errors or need arbitrary precision.
+
+    """
+    JD = numpy.asarray(JD,dtype='d').ravel()
+    if JD.size == 0:
+        return []
+    if not numpy.all(numpy.isfinite(JD)) or JD.max() > 5.e6:
+        return [_DateFromJulianDayScalar(j,calendar) for j in JD]
+    year, month, day, hour, minute, second, dayofwk, dayofyr = _DateFieldsFromJulianDay(JD,calendar)
+    if calendar in ['standard','gregorian','proleptic_gregorian','julian'] and (year.min() < 1 or year.max() > 9999):
+        return [_DateFromJulianDayScalar(j,calendar) for j in JD]
+    if calendar == 'proleptic_gregorian':
+        real = numpy.ones(JD.shape,bool)
+    elif calendar in ['standard','gregorian']:
+        real = JD >= 2299160.5
+    else:
+        real = numpy.zeros(JD.shape,bool)
+    fields = zip(year.tolist(),month.tolist(),day.tolist(),hour.tolist(),minute.tolist(),second.tolist(),dayofwk.tolist(),dayofyr.tolist())
+    if real.all():
+        return [real_datetime(*f[:6]) for f in fields]
+    return [real_datetime(*f[:6]) if r else datetime(*f) for f, r in zip(fields,real.tolist())]
+
+def _DateFromJulianDayScalar(JD,calendar='standard'):
+    if calendar in ['noleap','365_day']:
+        return _DateFromNoLeapDay(JD)
+    elif calendar in ['all_leap','366_day']:
+        return _DateFromAllLeap(JD)
+    elif calendar == '360_day':
+        return _DateFrom360Day(JD)
+    return DateFromJulianDay(JD,calendar)
+
 def _dateparse(timestr):
     """parse a string of the form time-units since yyyy-mm-dd hh:mm:ss
     return a tuple (units,utc_offset, datetimeinstance)"""
@@ -667,42 +880,27 @@ Returns a scalar if input is a scalar, else returns a numpy array.
         except:
             isscalar = True
         if not isscalar:
+            # arrays are converted at once by the vectorised functions.
             date = numpy.array(date)
             shape = date.shape
-        if self.calendar in ['julian','standard','gregorian','proleptic_gregorian']:
-            if isscalar:
-                jdelta = JulianDayFromDate(date,self.calendar)-self._jd0
-            else:
-                jdelta = [JulianDayFromDate(d,self.calendar)-self._jd0 for d in date.flat]
+            year, month, day, hour, minute, second = _DateFieldsFromDates(date)
+            if self.calendar in ['noleap','365_day'] and numpy.any((month == 2) & (day == 29)):
+                raise ValueError('there is no leap day in the noleap calendar')
+            if self.calendar == '360_day' and numpy.any(day > 30):
+                raise ValueError('there are only 30 days in every month with the 360_day calendar')
+            jdelta = _JulianDayFromFields(year,month,day,hour,minute,second,self.calendar) - self._jd0
+        elif self.calendar in ['julian','standard','gregorian','proleptic_gregorian']:
+            jdelta = JulianDayFromDate(date,self.calendar)-self._jd0
         elif self.calendar in ['noleap','365_day']:
-            if isscalar:
-                if date.month == 2 and date.day == 29:
-                    raise ValueError('there is no leap day in the noleap calendar')
-                jdelta = _NoLeapDayFromDate(date) - self._jd0
-            else:
-                jdelta = []
-                for d in date.flat:
-                    if d.month == 2 and d.day == 29:
-                        raise ValueError('there is no leap day in the noleap calendar')
-                    jdelta.append(_NoLeapDayFromDate(d)-self._jd0)
+            if date.month == 2 and date.day == 29:
+                raise ValueError('there is no leap day in the noleap calendar')
+            jdelta = _NoLeapDayFromDate(date) - self._jd0
         elif self.calendar in ['all_leap','366_day']:
-            if isscalar:
-                jdelta = _AllLeapFromDate(date) - self._jd0
-            else:
-                jdelta = [_AllLeapFromDate(d)-self._jd0 for d in date.flat]
+            jdelta = _AllLeapFromDate(date) - self._jd0
         elif self.calendar == '360_day':
-            if isscalar:
-                if date.day > 30:
-                    raise ValueError('there are only 30 days in every month with the 360_day calendar')
-                jdelta = _360DayFromDate(date) - self._jd0
-            else:
-                jdelta = []
-                for d in date.flat:
-                    if d.day > 30:
-                        raise ValueError('there are only 30 days in every month with the 360_day calendar')
-                    jdelta.append(_360DayFromDate(d)-self._jd0)
-        if not isscalar:
-            jdelta = numpy.array(jdelta)
+            if date.day > 30:
+                raise ValueError('there are only 30 days in every month with the 360_day calendar')
+            jdelta = _360DayFromDate(date) - self._jd0
         # convert to desired units, add time zone offset.
         if self.units in ['second','seconds']:
             jdelta = jdelta*86400. + self.tzoffset*60.
@@ -761,41 +959,26 @@ do not exist in any real world calendar.
         elif self.units in ['day','days']:
             jdelta = time_value - self.tzoffset/1440.
         jd = self._jd0 + jdelta
-        if self.calendar in ['julian','standard','gregorian','proleptic_gregorian']:
-            if not isscalar:
-                if ismasked:
-                    date = []
-                    for j,m in zip(jd.flat, mask.flat):
-                        if not m:
-                            date.append(DateFromJulianDay(j,self.calendar))
-                        else:
-                            date.append(None)
-                else:
-                    date = [DateFromJulianDay(j,self.calendar) for j in jd.flat]
-            else:
-                if ismasked and mask.item():
-                    date = None
-                else:
-                    date = DateFromJulianDay(jd,self.calendar)
-        elif self.calendar in ['noleap','365_day']:
-            if not isscalar:
-                date = [_DateFromNoLeapDay(j) for j in jd.flat]
+        if not isscalar:
+            # arrays are converted at once by the vectorised functions,
+            # masked values give None for the gregorian and julian calendars.
+            date = numpy.empty(jd.size,object)
+            if ismasked and self.calendar in ['julian','standard','gregorian','proleptic_gregorian']:
+                valid = ~numpy.ma.getmaskarray(numpy.ma.array(jd,mask=mask)).ravel()
+                date[valid] = _DatesFromJulianDay(jd.ravel()[valid],self.calendar)
             else:
-                date = _DateFromNoLeapDay(jd)
-        elif self.calendar in ['all_leap','366_day']:
-            if not isscalar:
-                date = [_DateFromAllLeap(j) for j in jd.flat]
+                date[:] = _DatesFromJulianDay(jd,self.calendar)
+        elif self.calendar in ['julian','standard','gregorian','proleptic_gregorian']:
+            if ismasked and mask.item():
+                date = None
             else:
-                date = _DateFromAllLeap(jd)
-        elif self.calendar == '360_day':
-            if not isscalar:
-                date = [_DateFrom360Day(j) for j in jd.flat]
-            else:
-                date = _DateFrom360Day(jd)
+                date = DateFromJulianDay(jd,self.calendar)
+        else:
+            date = _DateFromJulianDayScalar(jd,self.calendar)
         if isscalar:
             return date
         else:
-            return numpy.reshape(numpy.array(date),shape)
+            return numpy.reshape(date,shape)
 
 def _parse_timezone(tzstring):
     """Parses ISO 8601 time zone specs into tzinfo offsets
@@ -980,58 +1163,151 @@ contains one.
     cdftime = utime(units,calendar=calendar)
     return cdftime.num2date(times)
 
-def _check_index(indices, times, nctime, calendar, select):
-    """Return True if the time indices given correspond to the given times,
-    False otherwise.
+class TimeIndex:
+    """
+Index of a netCDF time variable with increasing values, for date2index and
+time2index queries.
 
-    Parameters:
+To initialize: C{index = TimeIndex(nctime,calendar=None)}
 
-    indices : sequence of integers
-    Positive integers indexing the time variable.
+Queries are answered with a binary search (C{numpy.searchsorted}) on the
+numeric time values, many dates or times can be given at once. The values
+that are read are cached, so keep the index to answer more queries on the
+same variable.
 
-    times : sequence of times.
-    Reference times.
+Short time variables are read at once. For long variables, which may be
+remote (e.g. OPeNDAP), only every C{blocksize}-th value is read up front and
+the blocks of C{blocksize} values around the queried times are read when
+needed.
 
-    nctime : netCDF Variable object
-    NetCDF time object.
+@ivar calendar: the calendar of nctime, from C{nctime.calendar} if not given.
+@ivar reads: the number of time values read from nctime so far.
+    """
+    def __init__(self,nctime,calendar=None,blocksize=4096,load=None):
+        """
+@param nctime: A netCDF time variable object with a C{units} attribute,
+supporting len() and (strided) slicing.
 
-    calendar : string
-    Calendar of nctime.
+@keyword calendar: Calendar of nctime, if None it is given by
+C{nctime.calendar} or C{standard} if no such attribute exists.
 
-    select : string
-    Index selection method.
-    """
-    N = nctime.shape[0]
-    if  (indices <0).any():
-       return False
-
-    if (indices >= N).any():
-        return False
-
-    t = nctime[indices]
-# if fancy indexing not available, fall back on this.
-#   t=[]
-#   for ind in indices:
-#       t.append(nctime[ind])
-
-    if select == 'exact':
-        return numpy.all(t == times)
-
-    elif select == 'before':
-        ta = nctime[numpy.clip(indices + 1, 0, N-1)]
-        return numpy.all(t <= times) and numpy.all(ta > times)
-
-    elif select == 'after':
-        tb = nctime[numpy.clip(indices - 1, 0, N-1)]
-        return numpy.all(t >= times) and numpy.all(tb < times)
-
-    elif select == 'nearest':
-        ta = nctime[numpy.clip(indices + 1, 0, N-1)]
-        tb = nctime[numpy.clip(indices - 1, 0, N-1)]
-        delta_after = ta - t
-        delta_before = t - tb
-        delta_check = numpy.abs(times-t)
-        return numpy.all(delta_check <= delta_after) and numpy.all(delta_check <= delta_before)
+@keyword blocksize: Number of values read at once for long variables.
+
+@keyword load: True reads all values at once, False reads blocks, None
+reads all values if there are at most 16 blocks.
+        """
+        if calendar == None:
+            calendar = getattr(nctime, 'calendar', 'standard')
+        self.nctime = nctime
+        self.calendar = calendar
+        self.units = nctime.units
+        self.blocksize = blocksize
+        self.size = len(nctime)
+        self.reads = 0
+        self._utime = None
+        self._blocks = {}
+        self._times = None
+        self._coarse = None
+        if load == None:
+            load = self.size <= 16*blocksize
+        if load:
+            self._times = self._read(slice(0,self.size))
+        else:
+            self._coarse = self._read(slice(0,self.size,blocksize))
+
+    def _read(self,index):
+        values = numpy.asarray(numpy.ma.getdata(self.nctime[index]),dtype='d').ravel()
+        self.reads = self.reads + len(values)
+        return values
+
+    def _block(self,k):
+        if k not in self._blocks:
+            self._blocks[k] = self._read(slice(k*self.blocksize,min((k+1)*self.blocksize,self.size)))
+        return self._blocks[k]
+
+    def values(self,indices):
+        """
+Returns the time values at the given (non-negative) indices.
+        """
+        indices = numpy.asarray(indices,int)
+        if self._times is not None:
+            return self._times[indices]
+        result = numpy.empty(indices.shape,'d')
+        blocks = indices//self.blocksize
+        for k in numpy.unique(blocks):
+            inblock = blocks == k
+            result[inblock] = self._block(k)[indices[inblock] - k*self.blocksize]
+        return result
+
+    def searchsorted(self,times,side='left'):
+        """
+Returns the indices where times would be inserted to keep the time values
+ordered, like C{numpy.searchsorted}.
+        """
+        times = numpy.asarray(times,'d')
+        if self._times is not None:
+            return numpy.searchsorted(self._times,times,side)
+        # the coarse values are the first values of the blocks,
+        # a time comes after the first value of block k-1 and at or before the first value of block k.
+        blocks = numpy.searchsorted(self._coarse,times,side) - 1
+        result = numpy.zeros(times.shape,int)
+        for k in numpy.unique(blocks[blocks >= 0]):
+            inblock = blocks == k
+            result[inblock] = k*self.blocksize + numpy.searchsorted(self._block(k),times[inblock],side)
+        return result
+
+    def time2index(self,times,select='exact'):
+        """
+Returns the indices corresponding to the given numeric times, see L{time2index}.
+        """
+        num = numpy.atleast_1d(numpy.asarray(times,'d'))
+        N = self.size
+        before = self.searchsorted(num,'right') == 0
+        index = self.searchsorted(num,'left')
+        after = index == N
+
+        if select in ['before', 'exact'] and numpy.any(before):
+            raise ValueError('Some of the times given are before the first time in `nctime`.')
+
+        if select in ['after', 'exact'] and numpy.any(after):
+            raise ValueError('Some of the times given are after the last time in `nctime`.')
+
+        # Find the times for which the match is not perfect.
+        index[after] = N-1
+        mismatch = self.values(index) != num
+
+        if select == 'exact':
+            if numpy.any(mismatch):
+                raise ValueError('Some of the times specified were not found in the `nctime` variable.')
+
+        elif select == 'before':
+            index[after] = N
+            index[mismatch] -= 1
+
+        elif select == 'after':
+            pass
+
+        elif select == 'nearest':
+            mismatch = mismatch & (index > 0)
+            previous = self.values(index[mismatch] - 1)
+            nearest_to_left = num[mismatch] < (previous + self.values(index[mismatch])) / 2.
+            index[mismatch] = index[mismatch] - 1 * nearest_to_left
+
+        else:
+            raise ValueError("%s is not an option for the `select` argument."%select)
+
+        # Correct for indices equal to -1
+        index[before] = 0
+
+        return _toscalar(numpy.reshape(index,numpy.shape(times)))
+
+    def date2index(self,dates,select='exact'):
+        """
+Returns the indices corresponding to the given dates, see L{date2index}.
+        """
+        if self._utime is None:
+            self._utime = utime(self.units,calendar=self.calendar)
+        return self.time2index(self._utime.date2num(dates),select)
 
 def date2index(dates, nctime, calendar=None, select='exact'):
     """
@@ -1044,14 +1320,16 @@ def date2index(dates, nctime, calendar=None, select='exact'):
 
     @param nctime: A netCDF time variable object. The nctime object must have a
     C{units} attribute. The entries are assumed to be stored in increasing
-    order.
+    order. A L{TimeIndex} of the variable can be given instead, which keeps
+    the values read for later queries.
 
     @param calendar: Describes the calendar used in the time calculation.
     Valid calendars C{'standard', 'gregorian', 'proleptic_gregorian'
     'noleap', '365_day', '360_day', 'julian', 'all_leap', '366_day'}.
     Default is C{'standard'}, which is a mixed Julian/Gregorian calendar
     If C{calendar} is None, its value is given by C{nctime.calendar} or
-    C{standard} if no such attribute exists.
+    C{standard} if no such attribute exists. Not used when nctime is a
+    L{TimeIndex}.
 
     @param select: C{'exact', 'before', 'after', 'nearest'}
     The index selection method. C{exact} will return the indices perfectly
@@ -1060,11 +1338,9 @@ def date2index(dates, nctime, calendar=None, select='exact'):
     an exact match cannot be found. C{nearest} will return the indices that
     correpond to the closest dates.
     """
-    # Setting the calendar.
-    if calendar == None:
-        calendar = getattr(nctime, 'calendar', 'standard')
-    times = date2num(dates,nctime.units,calendar=calendar)
-    return time2index(times, nctime, calendar=calendar, select=select)
+    if not isinstance(nctime, TimeIndex):
+        nctime = TimeIndex(nctime, calendar=calendar)
+    return nctime.date2index(dates, select=select)
 
 def time2index(times, nctime, calendar=None, select='exact'):
     """
@@ -1076,7 +1352,8 @@ def time2index(times, nctime, calendar=None, select='exact'):
 
     @param nctime: A netCDF time variable object. The nctime object must have a
     C{units} attribute. The entries are assumed to be stored in increasing
-    order.
+    order. A L{TimeIndex} of the variable can be given instead, which keeps
+    the values read for later queries.
 
     @param calendar: Describes the calendar used in the time calculation.
     Valid calendars C{'standard', 'gregorian', 'proleptic_gregorian'
@@ -1092,75 +1369,9 @@ def time2index(times, nctime, calendar=None, select='exact'):
     an exact match cannot be found. C{nearest} will return the indices that
     correpond to the closest times.
     """
-    # Setting the calendar.
-    if calendar == None:
-        calendar = getattr(nctime, 'calendar', 'standard')
-
-    num = numpy.atleast_1d(times)
-    N = len(nctime)
-
-    # Trying to infer the correct index from the starting time and the stride.
-    # This assumes that the times are increasing uniformly.
-    t0, t1 = nctime[:2]
-    dt = t1 - t0
-    if select in ['exact', 'before']:
-        index = numpy.array((num-t0)/dt, int)
-    elif select == 'after':
-        index = numpy.array(numpy.ceil( (num-t0)/dt ), int)
-    else:
-        index = numpy.array(numpy.around( (num-t0)/dt ), int)
-
-    # Checking that the index really corresponds to the given time.
-    # If the times do not correspond, then it means that the times
-    # are not increasing uniformly and we try the bisection method.
-    if not _check_index(index, times, nctime, calendar, select):
-
-        # Use the bisection method. Assumes nctime is ordered.
-        import bisect
-        index = numpy.array([bisect.bisect_right(nctime, n) for n in num], int)
-        before = index == 0
-
-        index = numpy.array([bisect.bisect_left(nctime, n) for n in num], int)
-        after = index == N
-
-        if select in ['before', 'exact'] and numpy.any(before):
-            raise ValueError('Some of the times given are before the first time in `nctime`.')
-
-        if select in ['after', 'exact'] and numpy.any(after):
-            raise ValueError('Some of the times given are after the last time in `nctime`.')
-
-
-        # Find the times for which the match is not perfect.
-        # Use list comprehension instead of the simpler `nctime[index]` since
-        # not all time objects support numpy integer indexing (eg dap).
-        index[after] = N-1
-        ncnum = numpy.squeeze([nctime[i] for i in index])
-        mismatch = numpy.nonzero(ncnum != num)[0]
-
-        if select == 'exact':
-            if len(mismatch) > 0:
-                raise ValueError('Some of the times specified were not found in the `nctime` variable.')
-
-        elif select == 'before':
-            index[after] = N
-            index[mismatch] -= 1
-
-        elif select == 'after':
-            pass
-
-        elif select == 'nearest':
-            nearest_to_left = num[mismatch] < numpy.array( [nctime[i-1] + nctime[i] for i in index[mismatch]]) / 2.
-            index[mismatch] = index[mismatch] - 1 * nearest_to_left
-
-        else:
-            raise ValueError("%s is not an option for the `select` argument."%select)
-
-
-        # Correct for indices equal to -1
-        index[before] = 0
-
-    # convert numpy scalars or single element arrays to python ints.
-    return _toscalar(index)
+    if not isinstance(nctime, TimeIndex):
+        nctime = TimeIndex(nctime, calendar=calendar)
+    return nctime.time2index(times, select=select)
 
 
 def _toscalar(a):
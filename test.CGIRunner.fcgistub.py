@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import os
+import sys
+import stat
+import time
+import socket
+import struct
+
+""" Emulates adagucserver for test.CGIRunner.worker.py: a FastCGI responder when stdin is a listening socket, a plain CGI program otherwise """
+""" The response is a text with the process id and QUERY_STRING, STUB_STARTUP seconds are spent on starting like ADAGUC reading its config """
+""" With ADAGUC_WRITETOFILE the text is written to that file, QUERY_STRING exit=<status> sets the exit status and crash=1 stops the process """
+""" hang=1 never answers, env=<name> adds the value of that variable in the request environment to the text """
+
+time.sleep(float(os.environ.get("STUB_STARTUP","0")))
+HEADER = struct.Struct(">BBHHBx")
+
+def respond(env,write):
+  query = dict(p.split("=",1) for p in env.get("QUERY_STRING","").split("&") if "=" in p)
+  if query.get("crash") == "1":
+    os._exit(1)
+  if query.get("hang") == "1":
+    time.sleep(3600)
+  body = "pid=%d query=%s" % (os.getpid(),env.get("QUERY_STRING",""))
+  if "env" in query:
+    body = body + " %s=%s" % (query["env"],env.get(query["env"]))
+  body = body + "\n"
+  body = body * int(query.get("repeat","1"))
+  if "ADAGUC_WRITETOFILE" in env:
+    open(env["ADAGUC_WRITETOFILE"],"w").write(body)
+  else:
+    write("Content-Type: text/plain\r\nContent-Length: %d\r\n\r\n%s" % (len(body),body))
+  return int(query.get("exit","0"))
+
+def receive(conn,size):
+  data = b""
+  while len(data) < size:
+    part = conn.recv(size-len(data))
+    if len(part) == 0:
+      raise EOFError()
+    data = data + part
+  return data
+
+def decodeParams(data):
+  params = {}
+  pos = 0
+  while pos < len(data):
+    lengths = []
+    for j in range(2):
+      if ord(data[pos]) < 128:
+        lengths.append(ord(data[pos]))
+        pos = pos + 1
+      else:
+        lengths.append(struct.unpack(">I",data[pos:pos+4])[0] & 0x7fffffff)
+        pos = pos + 4
+    params[data[pos:pos+lengths[0]]] = data[pos+lengths[0]:pos+lengths[0]+lengths[1]]
+    pos = pos + lengths[0] + lengths[1]
+  return params
+
+def record(recordtype,requestid,content):
+  return HEADER.pack(1,recordtype,requestid,len(content),0) + content
+
+def serve(conn):
+  paramdata = b""
+  while True:
+    version, recordtype, requestid, length, padding = HEADER.unpack(receive(conn,HEADER.size))
+    content = receive(conn,length+padding)[:length]
+    if recordtype == 4 and length > 0:
+      paramdata = paramdata + content
+    elif recordtype == 5 and length == 0:
+      break
+  out = []
+  status = respond(decodeParams(paramdata),out.append)
+  data = b"".join(out)
+  for start in range(0,len(data),65535):
+    conn.sendall(record(6,requestid,data[start:start+65535]))
+  conn.sendall(record(6,requestid,b"") + record(3,requestid,struct.pack(">IB3x",status,0)))
+
+def getListener():
+  if not stat.S_ISSOCK(os.fstat(0).st_mode):
+    return None
+  listener = socket.fromfd(0,socket.AF_UNIX,socket.SOCK_STREAM)
+  if listener.getsockopt(socket.SOL_SOCKET,socket.SO_ACCEPTCONN) == 0:
+    return None
+  return listener
+
+listener = getListener()
+if listener != None:
+  while True:
+    conn = listener.accept()[0]
+    try:
+      serve(conn)
+    except EOFError:
+      pass
+    conn.close()
+else:
+  sys.exit(respond(os.environ,sys.stdout.write))
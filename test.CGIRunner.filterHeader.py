@@ -0,0 +1,87 @@
+import sys
+import time
+import CGIRunner
+
+""" Compares the byte by byte header filter CGIRunner used before with the current one on test.CGIRunner.data """
+
+class OldFilter:
+  def __init__(self):
+    self.headersSent = False
+    self.foundLF = False
+
+  def filterHeader(self,_message,writefunction):
+      if self.headersSent == False:
+        message = bytearray(_message)
+        endHeaderIndex = 0
+        for j in range(len(message)):
+          if message[j] == 10 :
+            if self.foundLF == False:
+              self.foundLF = True
+              continue
+          elif self.foundLF == True and message[j] != 13:
+            self.foundLF = False
+            continue
+
+          if(self.foundLF == True):
+            if message[j] == 10 :
+              self.headersSent = True;
+              endHeaderIndex = j+2;
+              writefunction(message[endHeaderIndex:])
+              break;
+      else:
+        writefunction(_message)
+
+def filterdata(runner,data,chunksize):
+  parts = []
+  for start in range(0,len(data),chunksize):
+    runner.filterHeader(data[start:start+chunksize],parts.append)
+  return b"".join(bytes(p) for p in parts)
+
+data = open("test.CGIRunner.data","rb").read()
+bodystart = data.find(b"\r\n\r\n")+4
+failures = 0
+
+for chunksize in [10,8192,1024*1024]:
+  results = {}
+  for name, makerunner in [("old",OldFilter),("new",CGIRunner.CGIRunner)]:
+    start = time.time()
+    body = filterdata(makerunner(),data,chunksize)
+    results[name] = (body,time.time()-start)
+  print "chunks of %7d bytes: old %.3fs, new %.3fs" % (chunksize,results["old"][1],results["new"][1])
+  if results["new"][0] != data[bodystart:]:
+    failures = failures + 1
+    print "new body differs from the data after the headers"
+  if results["old"][0] != data[bodystart+1:]:
+    print "old body differs from the data after the headers"
+
+""" The empty line is split over every possible pair of chunks """
+for split in range(bodystart-5,bodystart+1):
+  runner = CGIRunner.CGIRunner()
+  parts = []
+  for part in [data[:split],data[split:bodystart+100]]:
+    runner.filterHeader(part,parts.append)
+  if b"".join(bytes(p) for p in parts) != data[bodystart:bodystart+100]:
+    failures = failures + 1
+    print "Split at %d gives a different body" % split
+
+""" Headers ending with LF LF """
+runner = CGIRunner.CGIRunner()
+parts = []
+runner.filterHeader(b"Content-Type: text/plain\nContent-Length: 4\n",parts.append)
+runner.filterHeader(b"\nbody",parts.append)
+if b"".join(bytes(p) for p in parts) != b"body" or runner.contentLength != 4 or runner.contentType != "text/plain":
+  failures = failures + 1
+  print "LF LF headers are not parsed"
+
+runner = CGIRunner.CGIRunner()
+filterdata(runner,data,8192)
+print "Headers: %s" % runner.headers
+print "Content-Length %s, body of %d bytes, Content-Type %s" % (runner.contentLength,len(data)-bodystart,runner.contentType)
+if runner.contentType != "text/plain":
+  failures = failures + 1
+
+print "The old filter skips the first byte of the body"
+if failures > 0:
+  print "%d failures" % failures
+  sys.exit(1)
+print "ready"
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import tempfile
+import CGIRunner
+
+""" Compares streaming the body of a CGI response into a file with passing every chunk through filterHeader as CGIRunner.run did before """
+""" Usage: python test.CGIRunner.stream.py [number of body lines ...], default 10 100000 1000000, uses test.CGIRunner.fcgistub.py as CGI program """
+
+SIZES = [int(a) for a in sys.argv[1:]] or [10,100000,1000000]
+STUB = [sys.executable,os.path.abspath("test.CGIRunner.fcgistub.py")]
+tmpdir = tempfile.mkdtemp()
+failures = 0
+
+def oldrun(url,out):
+  runner = CGIRunner.CGIRunner()
+  env = os.environ.copy()
+  env['QUERY_STRING']=url
+  ncout = open(out,"a+b")
+  def monitor1(_message):
+    runner.filterHeader(_message,ncout.write)
+  status = runner.startProcess(STUB,monitor1,env,bufsize=8192)
+  ncout.close()
+  return status
+
+for lines in SIZES:
+  url = "repeat=%d" % lines
+  start = time.time()
+  oldrun(url,tmpdir+"/old.txt")
+  old = time.time() - start
+  runner = CGIRunner.CGIRunner()
+  start = time.time()
+  status = runner.run(STUB,url,tmpdir+"/new.txt")
+  new = time.time() - start
+  body = open(tmpdir+"/new.txt","rb").read()
+  line = body.split("\n")[0]+"\n"
+  print "%8d bytes: %.3fs through filterHeader, %.3fs streamed" % (len(body),old,new)
+  if status != 0 or body != line*lines or runner.contentLength != len(body) or runner.contentType != "text/plain":
+    failures = failures + 1
+    print "Streamed body of %d lines differs, Content-Length %s" % (lines,runner.contentLength)
+
+""" The output file is replaced, not appended to """
+CGIRunner.CGIRunner().run(STUB,"repeat=1",tmpdir+"/new.txt")
+if len(open(tmpdir+"/new.txt").read().split("\n")) != 2:
+  failures = failures + 1
+  print "Output file is not replaced"
+
+""" Small blocks, the headers end in a later block than the first """
+runner = CGIRunner.CGIRunner()
+os.environ["QUERY_STRING"] = "repeat=100"
+runner.streamProcess(STUB,tmpdir+"/new.txt",blocksize=7)
+body = open(tmpdir+"/new.txt").read()
+if body != (body.split("\n")[0]+"\n")*100 or runner.contentLength != len(body):
+  failures = failures + 1
+  print "Body read in blocks of 7 bytes differs"
+
+import shutil
+shutil.rmtree(tmpdir)
+if failures > 0:
+  print "%d failures" % failures
+  sys.exit(1)
+print "ready"
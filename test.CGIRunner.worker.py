@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import tempfile
+import CGIRunner
+
+""" Tests the warm FastCGI workers of CGIRunner with test.CGIRunner.fcgistub.py and compares them with starting the stub for every request """
+""" Usage: python test.CGIRunner.worker.py [number of requests], default 20 """
+
+NUMREQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+STUB = [sys.executable,os.path.abspath("test.CGIRunner.fcgistub.py")]
+os.environ["STUB_STARTUP"] = "0.1"
+CGIRunner.resetBaseEnvironment()
+tmpdir = tempfile.mkdtemp()
+failures = 0
+
+def pidof(filename):
+  return open(filename).read().split()[0]
+
+""" A worker is reused until it handled maxrequests requests """
+pool = CGIRunner.WorkerPool(STUB,size=1,maxrequests=3)
+pids = []
+for j in range(7):
+  status = pool.run("request=%d" % j,tmpdir+"/out.txt",{"ADAGUC_LOGFILE":tmpdir+"/log.txt"},isLocalADAGUC=True)
+  text = open(tmpdir+"/out.txt").read()
+  if status != 0 or not text.endswith("query=request=%d\n" % j):
+    failures = failures + 1
+    print "Unexpected response %r with status %d" % (text,status)
+  pids.append(pidof(tmpdir+"/out.txt"))
+print "7 requests with maxrequests 3 used workers %s" % pids
+if len(set(pids)) != 3 or pids[0] != pids[2] or pids[2] == pids[3]:
+  failures = failures + 1
+  print "Workers are not reused or not recycled"
+
+""" A worker which stopped is replaced """
+pool.idle[0].process.terminate()
+pool.idle[0].process.wait()
+pool.run("request=afterstop",tmpdir+"/out.txt",isLocalADAGUC=True)
+if pidof(tmpdir+"/out.txt") in pids:
+  failures = failures + 1
+  print "A stopped worker was used"
+
+""" A request which crashes every worker raises, the pool keeps working """
+try:
+  pool.run("crash=1",tmpdir+"/out.txt",isLocalADAGUC=True)
+  failures = failures + 1
+  print "Crashing request did not raise"
+except ValueError as e:
+  print "Crashing request: %s" % e
+if pool.run("exit=3",tmpdir+"/out.txt",isLocalADAGUC=True) != 3:
+  failures = failures + 1
+  print "Exit status is not passed"
+pool.close()
+
+""" Requests get the environment of the python process, like ADAGUC_CONFIG, besides the per call variables """
+os.environ["STUB_CONFIG"] = "/config/adaguc.xml"
+CGIRunner.resetBaseEnvironment()
+pool = CGIRunner.WorkerPool(STUB,size=1,timeout=1)
+pool.run("env=STUB_CONFIG",tmpdir+"/out.txt",isLocalADAGUC=True)
+if not open(tmpdir+"/out.txt").read().endswith("STUB_CONFIG=/config/adaguc.xml\n"):
+  failures = failures + 1
+  print "Request environment misses the base environment: %r" % open(tmpdir+"/out.txt").read()
+
+""" An error writing the output does not cost the pool its worker """
+try:
+  pool.run("repeat=1",tmpdir+"/nonexistent/out.txt")
+  failures = failures + 1
+  print "Writing to a missing directory did not raise"
+except IOError as e:
+  print "Writing to a missing directory: %s" % e
+if pool.numworkers != 0:
+  failures = failures + 1
+  print "Worker of the failed request is not given back, %d workers in use" % pool.numworkers
+pool.run("request=afterioerror",tmpdir+"/out.txt",isLocalADAGUC=True)
+if not open(tmpdir+"/out.txt").read().endswith("query=request=afterioerror\n"):
+  failures = failures + 1
+  print "Pool does not work after an error writing the output"
+
+""" A hung worker is replaced after the timeout """
+start = time.time()
+try:
+  pool.run("hang=1",tmpdir+"/out.txt",isLocalADAGUC=True)
+  failures = failures + 1
+  print "Hanging request did not raise"
+except ValueError as e:
+  print "Hanging request after %.1fs: %s" % (time.time()-start,e)
+pool.run("request=afterhang",tmpdir+"/out.txt",isLocalADAGUC=True)
+if not open(tmpdir+"/out.txt").read().endswith("query=request=afterhang\n"):
+  failures = failures + 1
+  print "Pool does not work after a hung worker"
+pool.close()
+
+""" CGI responses have their headers stripped, like CGIRunner.run """
+pool = CGIRunner.WorkerPool(STUB,size=2)
+for repeat in [1,50000]:
+  pool.run("repeat=%d" % repeat,tmpdir+"/out.txt")
+  expected = open(tmpdir+"/out.txt").read().split("\n")[0]+"\n"
+  if open(tmpdir+"/out.txt").read() != expected*repeat:
+    failures = failures + 1
+    print "Body of %d lines differs" % repeat
+
+""" Concurrent requests through the shared process pool """
+results = [pool.arun("request=%d" % j,tmpdir+"/out%d.txt" % j,isLocalADAGUC=True) for j in range(8)]
+if [r.get() for r in results] != [0]*8 or len(pool.idle) > 2:
+  failures = failures + 1
+  print "Concurrent requests failed"
+for j in range(8):
+  if not open(tmpdir+"/out%d.txt" % j).read().endswith("query=request=%d\n" % j):
+    failures = failures + 1
+    print "Concurrent request %d got another response" % j
+
+""" Speed with STUB_STARTUP seconds of startup per process """
+start = time.time()
+for j in range(NUMREQUESTS):
+  if CGIRunner.CGIRunner().run(STUB,"request=%d" % j,tmpdir+"/out.txt",isLocalADAGUC=True) != 0:
+    failures = failures + 1
+    print "Request %d on a new process failed" % j
+forked = time.time() - start
+start = time.time()
+for j in range(NUMREQUESTS):
+  pool.run("request=%d" % j,tmpdir+"/out.txt",isLocalADAGUC=True)
+warm = time.time() - start
+print "%d requests: %.2fs with a new process per request, %.2fs with warm workers" % (NUMREQUESTS,forked,warm)
+pool.close()
+
+CGIRunner.closeWorkerPools()
+import shutil
+shutil.rmtree(tmpdir)
+if failures > 0:
+  print "%d failures" % failures
+  sys.exit(1)
+print "ready"
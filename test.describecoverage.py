@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import datetime
+import resource
+import tempfile
+from multiprocessing import Process, Queue
+from xml.dom import minidom
+import iteratewcs
+
+""" Compares minidom with the incremental parser of iteratewcs on a synthetic DescribeCoverage document """
+
+NUMTIMESTEPS = 100000
+
+def makedocument(filename,numtimesteps):
+  start = datetime.datetime(1900,1,1,12)
+  f = open(filename,"w")
+  f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+  f.write('<CoverageDescription xmlns="http://www.opengis.net/wcs" xmlns:gml="http://www.opengis.net/gml" version="1.0.0">\n')
+  f.write('<CoverageOffering><name>tas</name><domainSet><temporalDomain>\n')
+  for j in range(numtimesteps):
+    f.write('<gml:timePosition>%s</gml:timePosition>\n' % (start+datetime.timedelta(hours=j)).strftime("%Y-%m-%dT%H:%M:%SZ"))
+  f.write('</temporalDomain></domainSet></CoverageOffering></CoverageDescription>\n')
+  f.close()
+
+def parseminidom(filename):
+  xmldoc = minidom.parse(filename)
+  return [s.childNodes[0].nodeValue for s in xmldoc.getElementsByTagName('gml:timePosition')]
+
+def parseiterparse(filename):
+  return [value for name, value in iteratewcs.iterTimeElements(filename) if name == "timePosition"]
+
+def measure(function,filename,queue):
+  start = time.time()
+  values = function(filename)
+  queue.put((len(values),values[-1],time.time()-start,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+filename = tempfile.mktemp(suffix=".xml")
+makedocument(filename,NUMTIMESTEPS)
+print "Document with %d timesteps is %d bytes" % (NUMTIMESTEPS,os.stat(filename).st_size)
+
+results = {}
+for name, function in [("minidom",parseminidom),("iterparse",parseiterparse)]:
+  """ Each parser runs in its own process so that peak memory use can be compared """
+  queue = Queue()
+  p = Process(target=measure,args=(function,filename,queue))
+  p.start()
+  results[name] = queue.get()
+  p.join()
+  print "%-10s %d timesteps, last %s, %.3f seconds, peak RSS %d KB" % ((name,)+results[name])
+
+os.remove(filename)
+if results["minidom"][:2] != results["iterparse"][:2]:
+  print "Parsers do not agree"
+  sys.exit(1)
+print "ready"
@@ -0,0 +1,89 @@
+import sys
+import datetime
+import subprocess
+import iteratewcs
+
+""" Checks that the GetCoverage URL of a full group of dates fits in QUERY_STRING and that a process can be started with it """
+
+failures = 0
+BBOX = "-179.4375,-89.702158,180.5625,89.7021580"
+CRS = "EPSG:4326"
+COVERAGE = "tasmax"
+start = datetime.datetime(2006,1,1,12)
+dates = [start+datetime.timedelta(days=j) for j in range(20*365)]
+
+for WCSURL in ["source=/data/tasmax_day.nc","source=http://opendap.knmi.nl/knmi/thredds/dodsC/"+"x"*4000+".nc"]:
+  for width in [100,300]:
+    otherbytes = len(WCSURL)+len(COVERAGE)+len(BBOX)+len(CRS)+iteratewcs.QUERYSTRINGPARAMBYTES
+    maxdates = iteratewcs.getMaxDatesPerRequest(otherbytes)
+    gridsize = iteratewcs.getGridSize(BBOX,None,None,width,width)
+    datesperrequest = iteratewcs.getDatesPerRequest("netcdf",len(dates),gridsize,iteratewcs.DEFAULTMAXBYTESPERREQUEST,1,maxdates)
+    url = iteratewcs.getCoverageURL(WCSURL,"netcdf",COVERAGE,dates[:datesperrequest],BBOX,CRS,WIDTH=width,HEIGHT=width)
+    querystring = "QUERY_STRING="+url
+    print "WCSURL of %d bytes, %dx%d grid: %d dates per request, QUERY_STRING of %d bytes" % (len(WCSURL),width,width,datesperrequest,len(querystring))
+    if len(querystring) >= iteratewcs.MAXQUERYSTRINGBYTES or url.count("TIME=") != 1:
+      failures = failures + 1
+      print "QUERY_STRING is too long or has more than one TIME parameter"
+    try:
+      subprocess.call(["true"],env={"QUERY_STRING":url})
+    except OSError as e:
+      failures = failures + 1
+      print "Unable to start a process with this QUERY_STRING: %s" % e
+
+""" All dates of a group are in the TIME parameter """
+url = iteratewcs.getCoverageURL("source=a.nc","netcdf",COVERAGE,dates[:3],BBOX,CRS)
+if "TIME=2006-01-01T12%3A00%3A00Z%2C2006-01-02T12%3A00%3A00Z%2C2006-01-03T12%3A00%3A00Z&" not in url:
+  failures = failures + 1
+  print "Unexpected TIME parameter in %s" % url
+if "TIME=" in iteratewcs.getCoverageURL("source=a.nc","netcdf",COVERAGE,["*"],BBOX,CRS):
+  failures = failures + 1
+  print "A request without dates has a TIME parameter"
+
+""" Remote sources without ETag or Last-Modified are asked once, the .das response only for OPeNDAP paths """
+import time
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import adaguccache
+requests = []
+class HeadHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_HEAD(self):
+    requests.append(self.path)
+    self.send_response(200)
+    if self.path.startswith("/etag"):
+      self.send_header("ETag","\"v1\"")
+    self.end_headers()
+  def log_message(self,*args):
+    pass
+server = BaseHTTPServer.HTTPServer(("127.0.0.1",0),HeadHandler)
+thread = threading.Thread(target=server.serve_forever)
+thread.daemon = True
+thread.start()
+host = "http://127.0.0.1:%d" % server.server_port
+cachedir = tempfile.mkdtemp()
+cache = adaguccache.DiskCache(cachedir)
+for path, expectedrequests in [("/files/a.nc",["/files/a.nc"]),("/thredds/dodsC/a.nc",["/thredds/dodsC/a.nc","/thredds/dodsC/a.nc.das"])]:
+  del requests[:]
+  for j in range(3):
+    validator = iteratewcs.getSourceValidator("source="+host+path,cache)
+  if validator != None or requests != expectedrequests:
+    failures = failures + 1
+    print "Validating %s did HEAD requests %s" % (path,requests)
+  """ The cache remembers the source for other python processes """
+  iteratewcs.unvalidatedSources.clear()
+  del requests[:]
+  iteratewcs.getSourceValidator("source="+host+path,cache)
+  if len(requests) > 0:
+    failures = failures + 1
+    print "Unvalidated source %s is not remembered in the cache" % path
+if iteratewcs.getSourceValidator("source="+host+"/etag.nc",cache) != "etag=\"v1\"":
+  failures = failures + 1
+  print "ETag is not used as validator"
+server.shutdown()
+shutil.rmtree(cachedir)
+
+if failures > 0:
+  print "%d failures" % failures
+  sys.exit(1)
+print "ready"
@@ -0,0 +1,159 @@
+import sys
+import time
+import numpy
+import netcdftime_depr
+
+""" Checks the vectorised array conversions of netcdftime_depr against the scalar conversions and compares their speed """
+""" Usage: python test.netcdftime_depr.py [number of timestamps ...], default 100000 1000000 """
+
+SIZES = [int(a) for a in sys.argv[1:]] or [100000,1000000]
+""" The scalar path is timed on this many values and extrapolated for larger sizes """
+MAXSCALAR = 100000
+CALENDARS = ['standard','gregorian','proleptic_gregorian','julian','noleap','365_day','all_leap','366_day','360_day']
+
+def fields(date):
+  if date is None:
+    return None
+  result = (type(date).__name__,date.year,date.month,date.day,date.hour,date.minute,date.second)
+  if isinstance(date,netcdftime_depr.datetime):
+    result = result + (date.dayofwk,date.dayofyr)
+  return result
+
+def maketimes(n,units):
+  """ Hourly steps with a random fraction of a second around the rounding boundaries, from 1500 (before the gregorian switch) onwards """
+  numpy.random.seed(n)
+  hours = numpy.sort(numpy.random.randint(-4000000,4000000,n)).astype('d') + numpy.random.choice([0.,0.5/3600,1./7200+1e-9,59.5/3600,0.25],n)
+  scale = {"days":1./24,"hours":1.,"minutes":60.,"seconds":3600.}[units.split()[0]]
+  return hours*scale
+
+failures = 0
+print "Equivalence with the scalar path"
+for calendar in CALENDARS:
+  for units in ["hours since 1950-01-01 00:00:00","days since 1850-01-01","seconds since 2000-01-01 00:00:00 -6:00"]:
+    cdftime = netcdftime_depr.utime(units,calendar=calendar)
+    times = maketimes(20000,units)
+    if calendar in ['standard','gregorian']:
+      """ Dates in the gap between the julian and gregorian calendar cannot be converted back """
+      dates = cdftime.num2date(times)
+      times = times[numpy.array([not (d.year == 1582 and d.month == 10 and 4 < d.day < 15) for d in dates])]
+    dates = cdftime.num2date(times)
+    scalardates = [cdftime.num2date(t) for t in times]
+    bad = [j for j in range(len(times)) if fields(dates[j]) != fields(scalardates[j])]
+    nums = cdftime.date2num(dates)
+    scalarnums = numpy.array([cdftime.date2num(d) for d in scalardates])
+    badnums = numpy.flatnonzero(nums != scalarnums)
+    if len(bad) > 0 or len(badnums) > 0:
+      failures = failures + 1
+      print "%-20s %-42s num2date %d and date2num %d differences" % (calendar,units,len(bad),len(badnums))
+      for j in bad[:3]:
+        print "  %r: %s %s" % (times[j],fields(dates[j]),fields(scalardates[j]))
+      for j in badnums[:3]:
+        print "  %s: %r %r" % (fields(scalardates[j]),nums[j],scalarnums[j])
+
+""" Masked values give None for the gregorian calendars """
+cdftime = netcdftime_depr.utime("days since 2000-01-01")
+masked = numpy.ma.array([0.,1.,2.],mask=[False,True,False])
+if [fields(d) for d in cdftime.num2date(masked)] != [fields(cdftime.num2date(t)) for t in masked]:
+  failures = failures + 1
+  print "Masked values differ"
+
+""" datetime64 arrays give the same values as datetime objects """
+dates = cdftime.num2date(numpy.arange(0,1000,0.37))
+if not numpy.array_equal(cdftime.date2num(dates),cdftime.date2num(dates.astype('M8[us]'))):
+  failures = failures + 1
+  print "datetime64 values differ"
+
+""" date2index and time2index against a bisect reference on an irregular axis, with all values read and with blocks """
+class FakeTimeVariable:
+  units = "hours since 1950-01-01 00:00:00"
+  def __init__(self,values):
+    self.values = values
+    self.reads = 0
+  def __len__(self):
+    return len(self.values)
+  def __getitem__(self,index):
+    result = self.values[index]
+    self.reads = self.reads + numpy.size(result)
+    return result
+
+def referenceindex(values,n,select):
+  import bisect
+  values = list(values)
+  right = bisect.bisect_right(values,n)
+  left = bisect.bisect_left(values,n)
+  if select == 'exact':
+    return left if left < len(values) and values[left] == n else None
+  if select == 'before':
+    return right-1 if right > 0 else None
+  if select == 'after':
+    return left if left < len(values) else None
+  if right == 0:
+    return 0
+  if left == len(values):
+    return len(values)-1
+  if values[left] == n or left == 0:
+    return left
+  return left-1 if n < (values[left-1]+values[left])/2. else left
+
+numpy.random.seed(1)
+axis = numpy.cumsum(numpy.random.randint(1,48,100000)).astype('d')
+queries = numpy.concatenate((axis[numpy.random.randint(0,len(axis),500)],numpy.random.uniform(-100,axis[-1]+100,500)))
+for load in [True,False]:
+  for select in ['exact','before','after','nearest']:
+    nctime = FakeTimeVariable(axis)
+    index = netcdftime_depr.TimeIndex(nctime,blocksize=1000,load=load)
+    expected = [referenceindex(axis,n,select) for n in queries]
+    valid = numpy.array([e is not None for e in expected])
+    batch = index.time2index(queries[valid],select)
+    single = [index.time2index(n,select) for n in queries[valid][:50]]
+    if list(batch) != [e for e in expected if e is not None] or single != list(batch[:50]):
+      failures = failures + 1
+      print "time2index %s with load=%s differs" % (select,load)
+    try:
+      netcdftime_depr.time2index(queries[~valid][:1],nctime,select=select)
+      if not valid.all():
+        failures = failures + 1
+        print "time2index %s did not raise" % select
+    except ValueError:
+      pass
+
+""" With blocks only the coarse values and the blocks around the queried times are read """
+for load in [True,False]:
+  index = netcdftime_depr.TimeIndex(FakeTimeVariable(axis),blocksize=1000,load=load)
+  index.time2index(queries[:10],'nearest')
+  print "10 queries on %d values, load=%s: %d values read" % (len(axis),load,index.reads)
+
+""" Dates do not convert back to exactly the same numbers, so the nearest index is asked """
+dates = netcdftime_depr.num2date(axis[::1000],FakeTimeVariable.units)
+if list(netcdftime_depr.date2index(dates,FakeTimeVariable(axis),select='nearest')) != range(0,len(axis),1000):
+  failures = failures + 1
+  print "date2index differs"
+
+print "Speed, standard calendar, hours since 1950-01-01"
+cdftime = netcdftime_depr.utime("hours since 1950-01-01 00:00:00")
+for n in SIZES:
+  times = numpy.arange(n,dtype='d')
+  start = time.time()
+  dates = cdftime.num2date(times)
+  vectornum2date = time.time() - start
+  start = time.time()
+  cdftime.date2num(dates)
+  vectordate2num = time.time() - start
+  dates64 = numpy.datetime64('1950-01-01T00:00:00') + numpy.arange(n).astype('m8[h]')
+  start = time.time()
+  cdftime.date2num(dates64)
+  datetime64date2num = time.time() - start
+  m = min(n,MAXSCALAR)
+  start = time.time()
+  scalardates = [cdftime.num2date(t) for t in times[:m]]
+  scalarnum2date = (time.time() - start)*n/m
+  start = time.time()
+  [cdftime.date2num(d) for d in scalardates]
+  scalardate2num = (time.time() - start)*n/m
+  print "%9d timestamps: num2date %8.3fs vectorised, %8.3fs scalar (%.1fx), date2num %8.3fs vectorised, %8.3fs from datetime64, %8.3fs scalar (%.1fx)%s" % (
+    n,vectornum2date,scalarnum2date,scalarnum2date/vectornum2date,vectordate2num,datetime64date2num,scalardate2num,scalardate2num/vectordate2num," extrapolated" if m < n else "")
+
+if failures > 0:
+  print "%d failures" % failures
+  sys.exit(1)
+print "ready"
@@ -0,0 +1,44 @@
+import sys
+import numpy
+import zonalstats
+
+""" Checks zonalStatistics against numpy nan-reductions per region, with masked pixels holding a fill value of 1e20, NaNs and a fully masked region """
+
+failures = 0
+numpy.random.seed(12)
+ntime, ny, nx = 5, 30, 40
+labels = numpy.random.randint(0,8,(ny,nx))
+labels[:5,:5] = 9
+""" Region 8 is outside the data, region 9 has no valid values """
+labels[-1,-1] = 8
+data = 280. + numpy.random.standard_normal((ntime,ny,nx))*0.25
+mask = numpy.random.random_sample((ntime,ny,nx)) < 0.2
+mask[:,labels == 9] = True
+""" The first pixel of every region in the sorted order is masked """
+index = zonalstats.FeatureIndex(labels)
+mask.reshape(ntime,-1)[:,index.order[index.offsets[:-1]]] = True
+mask[:,labels == 8] = False
+data[mask] = 1e20
+data[0,10,10] = numpy.nan
+data[1,labels == 3] = numpy.nan
+stats = zonalstats.zonalStatistics(index,numpy.ma.array(data,mask=mask))
+
+for k in range(ntime):
+  for j, region in enumerate(index.regionids):
+    values = data[k][(labels == region) & ~mask[k]]
+    expected = {"count":numpy.count_nonzero(~numpy.isnan(values))}
+    for name, reduction in [("minimum",numpy.nanmin),("mean",numpy.nanmean),("maximum",numpy.nanmax),("standarddeviation",numpy.nanstd)]:
+      expected[name] = reduction(values) if expected["count"] > 0 else numpy.nan
+    if stats["count"][k][j] != expected["count"]:
+      failures = failures + 1
+      print "time %d region %d: count %d instead of %d" % (k,region,stats["count"][k][j],expected["count"])
+    for name in ["minimum","mean","maximum","standarddeviation"]:
+      got = stats[name][k][j]
+      if numpy.isnan(expected[name]) != numpy.isnan(got) or (not numpy.isnan(got) and abs(got-expected[name]) > 1e-6*max(1.,abs(expected[name]))):
+        failures = failures + 1
+        print "time %d region %d: %s %r instead of %r" % (k,region,name,got,expected[name])
+
+if failures > 0:
+  print "%d failures" % failures
+  sys.exit(1)
+print "ready"
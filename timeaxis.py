@@ -0,0 +1,98 @@
+"""
+Time axes as found in WCS DescribeCoverage responses.
+Both axes support len(), indexing, slicing, iteration and select(start_date,end_date), which returns the dates within the range.
+"""
+import bisect
+import datetime
+import isodate
+
+def _microseconds(delta):
+  return (delta.days*86400 + delta.seconds)*1000000 + delta.microseconds
+
+"""
+  Regular axis from gml:begin/gml:end/gml:duration, dates are computed from their index instead of being stored.
+"""
+class RegularTimeAxis:
+
+  def __init__(self,begin,end,duration,length=None):
+    self.begin = begin
+    self.step = _microseconds(duration)
+    if self.step <= 0:
+      raise ValueError("Time axis duration must be positive, got "+str(duration))
+    if length == None:
+      length = max(0,_microseconds(end-begin)//self.step+1)
+    self.length = length
+
+  def __len__(self):
+    return self.length
+
+  def __iter__(self):
+    j = 0
+    while j < self.length:
+      yield self.begin + datetime.timedelta(microseconds=j*self.step)
+      j = j + 1
+
+  def __getitem__(self,index):
+    if isinstance(index,slice):
+      start,stop,stride = index.indices(self.length)
+      if stride < 0:
+        return [self[j] for j in range(start,stop,stride)]
+      length = max(0,(stop-start+stride-1)//stride)
+      return RegularTimeAxis(self.begin + datetime.timedelta(microseconds=start*self.step),None,datetime.timedelta(microseconds=self.step*stride),length)
+    if index < 0:
+      index = index + self.length
+    if index < 0 or index >= self.length:
+      raise IndexError("Time axis index out of range")
+    return self.begin + datetime.timedelta(microseconds=index*self.step)
+
+  def select(self,start_date,end_date):
+    first = -((-_microseconds(start_date-self.begin))//self.step)
+    last = _microseconds(end_date-self.begin)//self.step
+    first = min(max(first,0),self.length)
+    last = min(max(last+1,first),self.length)
+    return self[first:last]
+
+"""
+  Axis from a list of gml:timePosition dates, kept sorted so that ranges are selected with a binary search.
+"""
+class ExplicitTimeAxis:
+
+  def __init__(self,dates):
+    self.dates = sorted(dates)
+
+  def __len__(self):
+    return len(self.dates)
+
+  def __iter__(self):
+    return iter(self.dates)
+
+  def __getitem__(self,index):
+    return self.dates[index]
+
+  def select(self,start_date,end_date):
+    return self.dates[bisect.bisect_left(self.dates,start_date):bisect.bisect_right(self.dates,end_date)]
+
+"""
+  Makes the axis for gml:begin/gml:end/gml:duration. Durations with years or months do not have a fixed length, these are expanded into an explicit axis.
+"""
+def makeTimeAxis(begin,end,duration):
+  if isinstance(duration,datetime.timedelta):
+    return RegularTimeAxis(begin,end,duration)
+  dates = []
+  date = begin
+  while date <= end:
+    dates.append(date)
+    date = date + duration
+  return ExplicitTimeAxis(dates)
+
+def axisToDict(axis):
+  if isinstance(axis,RegularTimeAxis):
+    return {"begin":axis.begin.isoformat(),"step":axis.step,"length":axis.length}
+  return {"dates":[d.isoformat() for d in axis]}
+
+def axisFromDict(data):
+  if not isinstance(data,dict):
+    raise ValueError("Not a serialized time axis")
+  if "dates" in data:
+    return ExplicitTimeAxis([isodate.parse_datetime(d) for d in data["dates"]])
+  return RegularTimeAxis(isodate.parse_datetime(data["begin"]),None,datetime.timedelta(microseconds=data["step"]),data["length"])
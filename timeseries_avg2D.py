@@ -59,6 +59,7 @@ class Process(WPSProcess):
 
         import pydap;
         import esgf
+        import zonalstats
        
 
         cred = home+"/certs/creds.pem"
@@ -80,7 +81,7 @@ class Process(WPSProcess):
         import pylab
         import base64
         import sys, os
-        import netcdftime
+        from netCDF4 import num2date
         pydap.lib.TIMEOUT = 120
         colors = ['b','g','r','c','m','y','k','w']
 
@@ -121,7 +122,8 @@ class Process(WPSProcess):
 	    except:
 		calendar = "standard"
 
-            dateObjects = netcdftime.num2date(datasetHeader.time, units=datasetHeader.time.units,calendar=calendar)
+            """ The time axis is fetched in one request and decoded as a vector """
+            dateObjects = num2date(np.asarray(datasetHeader.time[:]), units=datasetHeader.time.units,calendar=calendar)
             try:
               myUnits = str(datasetHeader[varname].units)
             except:
@@ -152,11 +154,11 @@ class Process(WPSProcess):
               dataset = open_dods(dodsURL);
               #print "received!"
 
+              """ Means of all timesteps in the chunk at once, NaN values are ignored. The DAP range includes stopTimeIndex, which is not used """
+              data=np.asarray(dataset[varname][varname][:])[:stopTimeIndex-startTimeIndex];
+              means=zonalstats.groupedStatistics(np.reshape(data,(len(data),-1)))["mean"][:,0];
               for j in range(startTimeIndex,stopTimeIndex):
-                data=dataset[varname][varname][j-startTimeIndex];
-                #data=dataset.tas.tas;
-                mean=np.mean(data[~np.isnan(data)]);
-                result.append(mean);
+                result.append(means[j-startTimeIndex]);
                 if makeAxis == True:
                   myAxis.append(dateObjects[j]);
               del dataset
@@ -0,0 +1,273 @@
+"""
+Zonal statistics: statistics of gridded data for every region of a label raster.
+"""
+import numpy
+
+"""
+  Index of a feature (label) raster, built once and reused for all timesteps and variables.
+  The flattened pixel indices of region regionids[j] are order[offsets[j]:offsets[j+1]], masked pixels and pixels with nodatavalue are left out.
+  ids and names are optional lookups indexed by region id, e.g. the features_NUTS_ID and features_NAME_ASCI variables.
+"""
+class FeatureIndex:
+
+  def __init__(self,labels,nodatavalue=None,ids=None,names=None):
+    flat = numpy.ma.getdata(labels).ravel()
+    self.shape = numpy.shape(labels)
+    self.nodatavalue = nodatavalue
+    self.ids = ids
+    self.names = names
+    """ Masked pixels are left out as well, e.g. a raster written without _FillValue is masked with the default fill value """
+    outside = numpy.ma.getmaskarray(labels).ravel()
+    if nodatavalue is not None:
+      outside = outside | (flat == nodatavalue)
+    pixels = numpy.flatnonzero(~outside)
+    self.order = pixels[numpy.argsort(flat[pixels],kind="mergesort")]
+    sortedlabels = flat[self.order]
+    starts = numpy.flatnonzero(sortedlabels[1:] != sortedlabels[:-1]) + 1
+    if self.order.size > 0:
+      starts = numpy.concatenate(([0],starts))
+    self.regionids = sortedlabels[starts]
+    self.offsets = numpy.concatenate((starts,[self.order.size])).astype(numpy.intp)
+    """ Position in regionids for every pixel in order """
+    self.regionofposition = numpy.repeat(numpy.arange(len(self.regionids)),numpy.diff(self.offsets))
+
+  def __len__(self):
+    return len(self.regionids)
+
+  """
+    Builds the index from the features variable of an open netCDF4 Dataset, including the NUTS lookups when available.
+  """
+  @classmethod
+  def fromDataset(cls,dataset,variable="features"):
+    featurevar = dataset.variables[variable]
+    labels = featurevar[:]
+    nodatavalue = getattr(featurevar,"_FillValue",None)
+    lookups = []
+    for name in [variable+"_NUTS_ID",variable+"_NAME_ASCI"]:
+      lookup = None
+      if name in dataset.variables:
+        lookup = dataset.variables[name][:]
+      lookups.append(lookup)
+    return cls(labels,nodatavalue,lookups[0],lookups[1])
+
+  @classmethod
+  def fromNetCDF(cls,filename,variable="features"):
+    import netCDF4
+    dataset = netCDF4.Dataset(filename,'r')
+    try:
+      return cls.fromDataset(dataset,variable)
+    finally:
+      dataset.close()
+
+  """ Returns the id of the region at position j, taken from the ids lookup when available """
+  def getRegionId(self,j):
+    if self.ids is not None:
+      return self.ids[self.regionids[j]]
+    return self.regionids[j]
+
+  """ Returns the name of the region at position j, taken from the names lookup when available """
+  def getRegionName(self,j):
+    if self.names is not None:
+      return self.names[self.regionids[j]]
+    return self.regionids[j]
+
+"""
+  Statistics kernel for grouped data, computing all statistics with a few vectorised passes over the values (reduceat per group).
+  Besides the float64 values, at most one other float64 array of the same size exists at a time, the counts are summed from the bool masks.
+  values has shape (...,n), the members of a group are stored contiguously and the (non-empty) groups start at the positions in starts.
+  Values where mask is True and NaN values are ignored.
+  Each group is shifted by its first valid value before summing (shifted data algorithm), which keeps the variance accurate when the mean is large compared to the spread.
+  Masked values still hold the fill value (e.g. 1e20) and are never used as shift.
+  Returns a dict of arrays with shape (...,numgroups):
+    unmasked: number of values which are not masked (NaN included)
+    count: number of valid values
+    minimum, maximum, mean and variance (population): NaN for groups without valid values
+"""
+def groupedStatistics(values,mask=None,starts=None):
+  values = numpy.asarray(values,dtype=numpy.float64)
+  if starts is None:
+    starts = [0]
+  starts = numpy.asarray(starts,dtype=numpy.intp)
+  groupofposition = numpy.repeat(numpy.arange(len(starts)),numpy.diff(numpy.append(starts,values.shape[-1])))
+  unmasked = numpy.ones(values.shape,dtype=bool) if mask is None else ~numpy.asarray(mask,dtype=bool)
+  valid = unmasked & ~numpy.isnan(values)
+  """ Position of the first valid value of every group, n for groups without valid values """
+  n = values.shape[-1]
+  firstvalid = numpy.minimum.reduceat(numpy.where(valid,numpy.arange(n),n),starts,axis=-1)
+  shift = numpy.take_along_axis(values,numpy.minimum(firstvalid,n-1),axis=-1)
+  shift = numpy.where((firstvalid < n) & numpy.isfinite(shift),shift,0.)
+  unmaskedcount = numpy.add.reduceat(unmasked,starts,axis=-1,dtype=numpy.int64)
+  count = numpy.add.reduceat(valid,starts,axis=-1,dtype=numpy.int64)
+  """ The sum and the sum of squares of the shifted values, the squares are computed in place """
+  deviation = values - shift[...,groupofposition]
+  deviation[~valid] = 0.
+  total = numpy.add.reduceat(deviation,starts,axis=-1)
+  numpy.multiply(deviation,deviation,out=deviation)
+  squares = numpy.add.reduceat(deviation,starts,axis=-1)
+  del deviation
+  minimum = numpy.minimum.reduceat(numpy.where(valid,values,numpy.inf),starts,axis=-1)
+  maximum = numpy.maximum.reduceat(numpy.where(valid,values,-numpy.inf),starts,axis=-1)
+  with numpy.errstate(invalid="ignore",divide="ignore"):
+    mean = shift + total/count
+    variance = numpy.maximum((squares - total*total/count)/count,0.)
+  empty = (count == 0)
+  minimum[empty] = numpy.nan
+  maximum[empty] = numpy.nan
+  mean[empty] = numpy.nan
+  variance[empty] = numpy.nan
+  return {"unmasked":unmaskedcount,
+          "count":count,
+          "minimum":minimum,
+          "maximum":maximum,
+          "mean":mean,
+          "variance":variance}
+
+"""
+  Calculates the statistics of data for all regions at once.
+  data has the shape of the label raster, optionally preceded by other dimensions like time, e.g. (time,y,x).
+  Masked and NaN values are ignored, the standard deviation is the population standard deviation like numpy.nanstd.
+  Returns a dict of arrays with shape (...,numregions):
+    pixels: number of pixels of the region
+    unmasked: number of pixels which are not masked
+    count: number of valid values (not masked and not NaN)
+    minimum, mean, maximum, standarddeviation: NaN for regions without valid values
+"""
+def zonalStatistics(featureindex,data):
+  values = numpy.ma.getdata(data)
+  leading = values.shape[:-2]
+  resultdtype = values.dtype if values.dtype.kind == "f" else numpy.dtype("f8")
+  if len(featureindex) == 0:
+    empty = numpy.zeros(leading+(0,))
+    return {"pixels":numpy.zeros(0,dtype=int),"unmasked":empty.astype(int),"count":empty.astype(int),
+            "minimum":empty.astype(resultdtype),"mean":empty.astype(resultdtype),"maximum":empty.astype(resultdtype),"standarddeviation":empty.astype(resultdtype)}
+  order = featureindex.order
+  stats = groupedStatistics(values.reshape(leading+(-1,))[...,order],
+                            numpy.ma.getmaskarray(data).reshape(leading+(-1,))[...,order],
+                            featureindex.offsets[:-1])
+  return {"pixels":numpy.diff(featureindex.offsets),
+          "unmasked":stats["unmasked"],
+          "count":stats["count"],
+          "minimum":stats["minimum"].astype(resultdtype),
+          "mean":stats["mean"].astype(resultdtype),
+          "maximum":stats["maximum"].astype(resultdtype),
+          "standarddeviation":numpy.sqrt(stats["variance"]).astype(resultdtype)}
+
+"""
+  Makes a raster of shape (...,y,x) where every pixel of a region gets the value of its region.
+  regionvalues has shape (...,numregions), regions where keep is False and pixels outside regions are masked.
+"""
+def expandToRaster(featureindex,regionvalues,shape,keep=None):
+  regionvalues = numpy.ma.asarray(regionvalues)
+  if keep is not None:
+    regionvalues = numpy.ma.masked_where(~keep,regionvalues)
+  leading = tuple(shape[:-2])
+  raster = numpy.ma.masked_all(leading+(int(numpy.prod(shape[-2:])),),dtype=regionvalues.dtype)
+  raster[...,featureindex.order] = regionvalues[...,featureindex.regionofposition]
+  return raster.reshape(shape)
+
+"""
+  Returns data masked everywhere except for the pixels of the regions where keep is True.
+"""
+def maskToRegions(featureindex,data,keep=None):
+  order = featureindex.order
+  data = numpy.ma.asarray(data)
+  shape = data.shape
+  leading = shape[:-2]
+  flat = data.reshape(leading+(-1,))
+  raster = numpy.ma.masked_all(flat.shape,dtype=data.dtype)
+  if keep is None:
+    raster[...,order] = flat[...,order]
+  else:
+    raster[...,order] = numpy.ma.masked_where(~keep[...,featureindex.regionofposition],flat[...,order])
+  return raster.reshape(shape)
+
+"""
+  Writes statistics rows to a CSV file while they are produced, instead of collecting the whole table in memory.
+"""
+class StatisticsCSVWriter:
+
+  header = "time;variable;index;id;name;numsamples;min;mean;max;std;\n"
+
+  def __init__(self,filename,buffersize=1024*1024):
+    self.file = open(filename,"wb",buffersize)
+    self.file.write(self.header)
+
+  """
+    Writes the rows for a block of timesteps, stats and keep come from zonalStatistics on (time,y,x) data.
+    Regions where keep is False are left out.
+  """
+  def writeBlock(self,featureindex,variable,timevalues,stats,keep):
+    for k in range(0,len(timevalues)):
+      rows = []
+      for j in numpy.flatnonzero(keep[k]):
+        rows.append(";".join([timevalues[k],str(variable),str(featureindex.regionids[j]),str(featureindex.getRegionId(j)),str(featureindex.getRegionName(j)),
+                              str(stats["pixels"][j]),str(stats["minimum"][k][j]),str(stats["mean"][k][j]),str(stats["maximum"][k][j]),str(stats["standarddeviation"][k][j])])+"\n")
+      self.file.write("".join(rows))
+
+  def close(self):
+    self.file.close()
+
+"""
+  Writes statistics as (time,region) variables into an open netCDF4 Dataset, one value per region instead of full rasters.
+  The region dimension comes with the variables region (feature index), region_id and region_name.
+"""
+class StatisticsTableWriter:
+
+  def __init__(self,dataset,featureindex,timevar,regiondim="region"):
+    self.dataset = dataset
+    self.featureindex = featureindex
+    self.regiondim = regiondim
+    self.timedim = timevar.dimensions[0]
+    if not self.timedim in dataset.dimensions:
+      dataset.createDimension(self.timedim,None)
+    if not self.timedim in dataset.variables:
+      outtime = dataset.createVariable(self.timedim,timevar.datatype,(self.timedim,))
+      outtime.setncatts(dict((k,timevar.getncattr(k)) for k in timevar.ncattrs() if k != "_FillValue"))
+      outtime[:] = timevar[:]
+    dataset.createDimension(regiondim,len(featureindex))
+    regionvar = dataset.createVariable(regiondim,"i4",(regiondim,))
+    regionvar.long_name = "Feature index of the region"
+    regionvar[:] = featureindex.regionids
+    numsamplesvar = dataset.createVariable(regiondim+"_numsamples","i4",(regiondim,))
+    numsamplesvar.long_name = "Number of grid cells in the region"
+    numsamplesvar[:] = numpy.diff(featureindex.offsets)
+    for name, lookup, getter in [("id",featureindex.ids,featureindex.getRegionId),("name",featureindex.names,featureindex.getRegionName)]:
+      if lookup is None:
+        continue
+      lookupvar = dataset.createVariable(regiondim+"_"+name,str,(regiondim,))
+      lookupvar[:] = numpy.array([str(getter(j)) for j in range(0,len(featureindex))],dtype=object)
+
+  """
+    Creates the (time,region) variable for a statistic, attributes is a dict of netCDF attributes, e.g. those of the raster variable.
+  """
+  def addVariable(self,name,attributes):
+    outvar = self.dataset.createVariable(name,"f4",(self.timedim,self.regiondim),fill_value=-9999.0)
+    outvar.setncatts(dict((k,v) for k, v in attributes.items() if k != "_FillValue"))
+    return outvar
+
+  """
+    Writes the values of one statistic for a block of timesteps starting at start, regions where keep is False are masked.
+  """
+  def writeBlock(self,name,start,values,keep):
+    values = numpy.ma.masked_where(~keep,values)
+    self.dataset.variables[name][start:start+values.shape[0]] = values
+
+"""
+  Gridded view of a (time,region) statistic written by StatisticsTableWriter next to the features raster.
+  Nothing is expanded up front, indexing the view along time returns the rasters of (...,y,x) for those timesteps only.
+"""
+class RegionRasterView:
+
+  def __init__(self,dataset,name,variable="features",regiondim="region"):
+    self.featureindex = FeatureIndex.fromDataset(dataset,variable)
+    self.variable = dataset.variables[name]
+    if regiondim in dataset.variables and not numpy.array_equal(dataset.variables[regiondim][:],self.featureindex.regionids):
+      raise ValueError("Regions of "+str(name)+" do not match the "+str(variable)+" raster")
+    self.shape = tuple(self.variable.shape[:-1])+tuple(self.featureindex.shape)
+
+  def __len__(self):
+    return self.shape[0]
+
+  def __getitem__(self,index):
+    values = numpy.ma.asarray(self.variable[index])
+    return expandToRaster(self.featureindex,values,values.shape[:-1]+tuple(self.featureindex.shape))